@@ -1,13 +1,14 @@
+from datetime import datetime
 from json import dumps
-import json
 from os import environ, urandom
 
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, decode_token
 from flask_mqtt import Mqtt
 from flask_restx import Api
-from flask_socketio import SocketIO, emit
+from flask_socketio import ConnectionRefusedError, SocketIO, emit
+from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
@@ -28,11 +29,44 @@ app.config["MQTT_BROKER_PORT"] = int(environ.get("BROKER_PORT") or 1883)
 app.config["MQTT_TLS_ENABLED"] = (environ.get("BROKER_TLS_ENABLED") == True) or False
 app.config["MQTT_KEEPALIVE"] = 5
 
+app.config["CLUSTER_MODE"] = (environ.get("CLUSTER_MODE") or "").lower() == "true"
+app.config["MQTT_SHARED_GROUP"] = environ.get("MQTT_SHARED_GROUP") or "iot-backend"
+
+app.config["TELEMETRY_BATCH_SIZE"] = int(environ.get("TELEMETRY_BATCH_SIZE") or 500)
+app.config["TELEMETRY_FLUSH_INTERVAL"] = float(environ.get("TELEMETRY_FLUSH_INTERVAL") or 1.0)
+app.config["TELEMETRY_MAX_BUFFER"] = int(environ.get("TELEMETRY_MAX_BUFFER") or 50000)
+app.config["TELEMETRY_BLOCK_TIMEOUT"] = float(environ.get("TELEMETRY_BLOCK_TIMEOUT") or 0.5)
+
+app.config["RECENT_SIZE"] = int(environ.get("RECENT_SIZE") or 120)
+app.config["RECENT_MAX_SERIES"] = int(environ.get("RECENT_MAX_SERIES") or 20000)
+app.config["RECENT_IDLE_SECONDS"] = float(environ.get("RECENT_IDLE_SECONDS") or 3600)
+app.config["RECENT_SHARE_INTERVAL"] = float(environ.get("RECENT_SHARE_INTERVAL") or 0.25)
+
+app.config["VALUES_COALESCE_MS"] = float(environ.get("VALUES_COALESCE_MS") or 0)
+
+app.config["COMMAND_TIMEOUT"] = float(environ.get("COMMAND_TIMEOUT") or 30)
+app.config["COMMAND_MAX_PENDING"] = int(environ.get("COMMAND_MAX_PENDING") or 10000)
+
+app.config["INGEST_QUEUE_SIZE"] = int(environ.get("INGEST_QUEUE_SIZE") or 10000)
+app.config["INGEST_WORKERS"] = int(environ.get("INGEST_WORKERS") or 2)
+app.config["INGEST_OVERFLOW"] = environ.get("INGEST_OVERFLOW") or "drop-oldest"
+
+app.config["ALARM_COMMAND"] = environ.get("ALARM_COMMAND") or "alarm"
+
+app.config["DOSE_COMMAND"] = environ.get("DOSE_COMMAND") or "dispense"
+app.config["DOSE_TIMEZONE"] = environ.get("DOSE_TIMEZONE") or None
+app.config["DOSE_GRACE_SECONDS"] = float(environ.get("DOSE_GRACE_SECONDS") or 300)
+
 jwt = JWTManager(app)
 
 mqtt_client = Mqtt(app)
 
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode=environ.get("SOCKETIO_ASYNC_MODE") or None,
+    message_queue=environ.get("SOCKETIO_MESSAGE_QUEUE") or None,
+)
 
 api = Api(
     app,
@@ -48,16 +82,29 @@ COMMAND_TOPIC = BASE_TOPIC + "command/"
 COMMAND_RES_TOPIC = BASE_TOPIC + "commandresult/"
 VALUES_TOPIC = BASE_TOPIC + "values/"
 
-commands_awaiting = dict()
-
+from app.alarm import api as alarm_ns
+from app.alarm_rules import alarm_engine
 from app.auth import api as auth_ns
+from app.cache import serial_resolver
+from app.cluster import CLUSTER_TOPIC, cluster_bus
+from app.coalescer import values_coalescer
+from app.codecs import payload_codec
+from app.commands import pending_commands
 from app.config import api as config_ns
+from app.database import Device, User, db, users_devices
 from app.device import api as device_ns
 from app.device import api_command as command_ns
 from app.device_type import api as device_type_ns
 from app.device_type import api_action as device_action_ns
 from app.device_type import api_action_param as device_action_param_ns
 from app.device_type import api_field as device_field_ns
+from app.dose import dose_scheduler
+from app.ingest import ingest_queue
+from app.recent import recent_readings
+from app.rooms import device_room, room_index
+from app.schema import telemetry_schemas
+from app.status import api as status_ns
+from app.telemetry import telemetry_buffer
 from app.user import api as user_ns
 
 api.add_namespace(auth_ns)
@@ -68,40 +115,112 @@ api.add_namespace(device_action_ns)
 api.add_namespace(device_action_param_ns)
 api.add_namespace(device_field_ns)
 api.add_namespace(config_ns)
+api.add_namespace(alarm_ns)
 api.add_namespace(user_ns)
+api.add_namespace(status_ns)
 
 
 @mqtt_client.on_connect()
 def handle_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected!")
-        mqtt_client.subscribe(BASE_TOPIC + "#")
+        if app.config["CLUSTER_MODE"]:
+            # values are ingested once per group; command results go to every worker,
+            # since only the one that sent the command knows its hash
+            mqtt_client.subscribe(f"$share/{app.config['MQTT_SHARED_GROUP']}/{VALUES_TOPIC}+")
+            mqtt_client.subscribe(COMMAND_RES_TOPIC + "+")
+            mqtt_client.subscribe(CLUSTER_TOPIC, qos=1)
+        else:
+            mqtt_client.subscribe(BASE_TOPIC + "#")
         print("subscribed")
     else:
         print('Error in connection', rc)
 
 
+@mqtt_client.on_topic(CLUSTER_TOPIC)
+def handle_mqtt_cluster(client, userdata, message):
+    # a dropped invalidation would leave this worker stale, so the bus never sheds
+    ingest_queue.put(process_cluster, message.topic, message.payload, policy="block")
+
+
 @mqtt_client.on_topic(COMMAND_RES_TOPIC + "+")
 def handle_mqtt_command_res(client, userdata, message):
-    serie_number = str(message.topic).split(COMMAND_RES_TOPIC)[1]
-    message_val = json.loads(message.payload.decode())
-    if message_val['hash'] in commands_awaiting:
-        command_res = commands_awaiting[message_val['hash']]
-        socketio.emit("command", { 'command': command_res, 'serie_number': serie_number, 'result': message_val['result'] })
-        del commands_awaiting[message_val['hash']]
+    ingest_queue.put(process_command_res, message.topic, message.payload)
 
 
 @mqtt_client.on_topic(VALUES_TOPIC + "+")
 def handle_mqtt_values(client, userdata, message):
-    serie_number = str(message.topic).split(VALUES_TOPIC)[1]
-    if not message.payload.decode().__eq__('Connected'):
-        for key, field in (dict)(json.loads(message.payload.decode())).items():
-            message = { 'msg': { 'serie_number': serie_number, 'name': key, 'value': field } }
-            socketio.emit("values", message)
-            print('Sended: ', json.dumps(message))
-
-
+    ingest_queue.put(process_values, message.topic, message.payload)
+
+
+def process_cluster(topic, payload, received_at):
+    cluster_bus.receive(payload)
+
+
+def process_command_res(topic, payload, received_at):
+    serie_number = str(topic).split(COMMAND_RES_TOPIC)[1]
+    message_val = payload_codec.decode(payload)
+    completed = pending_commands.complete(message_val['hash'], serie_number)
+    if completed:
+        command_res, latency = completed
+        socketio.emit("command", { 'command': command_res, 'serie_number': serie_number, 'result': message_val['result'], 'latency_ms': latency }, to=device_room(serie_number))
+
+
+def process_values(topic, payload, received_at):
+    serie_number = str(topic).split(VALUES_TOPIC)[1]
+    if payload != b'Connected':
+        device = serial_resolver.get(serie_number)
+        if device is None:
+            return
+        values = (dict)(payload_codec.decode_values(serie_number, payload, device.device_type))
+        values = telemetry_schemas.apply(device.device_type, values)
+        if not values:
+            return
+        telemetry_buffer.add(serie_number, values, datetime.utcfromtimestamp(received_at))
+        recent_readings.add(serie_number, values, received_at)
+        values_coalescer.push(serie_number, values)
+        alarm_engine.evaluate(device.id, serie_number, values)
+
+
+with app.app_context():
+    try:
+        serial_resolver.warm()
+        alarm_engine.load()
+        dose_scheduler.load()
+    except SQLAlchemyError as e:
+        print("Ingest caches not warmed", e)
+ingest_queue.start()
 mqtt_client._connect()
+telemetry_buffer.start()
+pending_commands.start()
+alarm_engine.start()
+dose_scheduler.start()
+
+
+@socketio.on("connect")
+def handle_socket_connect(auth=None):
+    token = (auth or {}).get("token") or request.args.get("token")
+    if not token:
+        raise ConnectionRefusedError("unauthorized")
+    try:
+        email = decode_token(token.replace("Bearer ", "", 1))["sub"]
+    except Exception:
+        raise ConnectionRefusedError("unauthorized")
+    user = db.session.query(User.id).filter(User.email == email).first()
+    if not user:
+        raise ConnectionRefusedError("unauthorized")
+    serie_numbers = (
+        db.session.query(Device.serie_number)
+        .join(users_devices, users_devices.c.device_id == Device.id)
+        .filter(users_devices.c.user_id == user.id)
+        .all()
+    )
+    room_index.connect(request.sid, user.id, [row.serie_number for row in serie_numbers])
+
+
+@socketio.on("disconnect")
+def handle_socket_disconnect():
+    room_index.disconnect(request.sid)
 
 
 @socketio.on("message")
@@ -0,0 +1,109 @@
+# pyright: reportOptionalSubscript=false
+from flask import abort, request
+from flask_jwt_extended import jwt_required
+from flask_restx import Namespace, Resource, fields
+
+from app.alarm_rules import alarm_engine
+from app.database import Alarm, db, users_devices
+from app.pagination import int_arg, keyset, page_args, stream_page
+from app.serializers import alarm_serializer, json_response
+
+api = Namespace("alarm", description="Alarm CRUD")
+
+alarm_model = api.model(
+    "AlarmModel",
+    {
+        "minutes": fields.Integer,
+        "hours": fields.Integer,
+        "repeatitions": fields.Integer,
+        "repeatitions_interval": fields.Integer(description="Seconds between repeats"),
+        "light": fields.Boolean,
+        "light_duration": fields.Integer,
+        "sound": fields.Boolean,
+        "sound_duration": fields.Integer,
+        "inform_to_user": fields.Boolean,
+        "field": fields.String(description="Device field watched by the alarm"),
+        "min_value": fields.Float,
+        "max_value": fields.Float,
+        "active": fields.Boolean(default=True),
+        "device_id": fields.Integer,
+    },
+)
+
+
+@api.route("", methods=["GET", "POST"])
+class AlarmView(Resource):
+    @api.doc(
+        security="Bearer",
+        params={
+            "limit": "Page size",
+            "after": "Return alarms with id greater than this cursor",
+            "device_id": "Device id",
+            "user_id": "Owner user id of the device",
+        },
+    )
+    @jwt_required()
+    def get(self):
+        limit, after = page_args()
+        query = db.session.query(*alarm_serializer.columns)
+        if request.args.get("device_id"):
+            query = query.filter(Alarm.device_id == int_arg("device_id"))
+        if request.args.get("user_id"):
+            query = query.join(
+                users_devices, users_devices.c.device_id == Alarm.device_id
+            ).filter(users_devices.c.user_id == int_arg("user_id"))
+        return stream_page(
+            keyset(query, Alarm.id, limit, after).all(), limit, alarm_serializer.row
+        )
+
+    @api.expect(alarm_model)
+    @api.doc(security="Bearer")
+    @jwt_required()
+    def post(self):
+        alarm = Alarm()
+        for param in alarm.columns():
+            if param not in ("id", "breached_at") and param in request.json:
+                setattr(alarm, param, request.json[param])
+        db.session.add(alarm)
+        db.session.commit()
+        alarm_engine.refresh(alarm.id)
+        return json_response(alarm_serializer(alarm))
+
+
+@api.route("/<int:id>", methods=["GET", "PATCH", "DELETE"])
+class AlarmIdView(Resource):
+    @api.doc(security="Bearer")
+    @jwt_required()
+    def get(self, id):
+        alarm = db.session.query(*alarm_serializer.columns).filter(Alarm.id == id).first()
+        if not alarm:
+            abort(404)
+        return json_response(alarm_serializer.row(alarm))
+
+    @api.expect(alarm_model)
+    @api.doc(security="Bearer")
+    @jwt_required()
+    def patch(self, id):
+        alarm = Alarm.query.filter_by(id=id).first()
+        if not alarm:
+            abort(404)
+        for param in alarm.columns():
+            if param != "breached_at" and param in request.json:
+                setattr(alarm, param, request.json[param])
+        # an edited rule starts over, like it does in the engine
+        alarm.breached_at = None
+        db.session.add(alarm)
+        db.session.commit()
+        alarm_engine.refresh(id)
+        return json_response(alarm_serializer(alarm))
+
+    @api.doc(security="Bearer")
+    @jwt_required()
+    def delete(self, id):
+        alarm = db.session.query(Alarm).filter(Alarm.id == id).first()
+        if not alarm:
+            abort(404)
+        db.session.delete(alarm)
+        db.session.commit()
+        alarm_engine.remove(id)
+        return "OK"
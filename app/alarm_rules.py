@@ -0,0 +1,274 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from app import COMMAND_TOPIC, app, mqtt_client, socketio
+from app.cluster import cluster_bus
+from app.codecs import payload_codec
+from app.commands import pending_commands
+from app.database import Alarm, db
+from app.rooms import device_room
+
+AlarmRule = namedtuple(
+    "AlarmRule",
+    (
+        "id",
+        "device_id",
+        "field",
+        "min_value",
+        "max_value",
+        "repeatitions",
+        "repeatitions_interval",
+        "light",
+        "light_duration",
+        "sound",
+        "sound_duration",
+        "inform_to_user",
+    ),
+)
+
+
+class AlarmEngine:
+    def __init__(self, command):
+        self.command = command
+        self.evaluated = 0
+        self.fired = 0
+        self.repeated = 0
+        self._rules = {}
+        self._index = {}
+        # rule id -> breached_at of the episode, shared by every worker over the bus
+        self._breached = {}
+        self._heap = []
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        cluster_bus.register("alarm_engine.update", self._update)
+        cluster_bus.register("alarm_engine.remove", self._remove)
+        cluster_bus.register("alarm_engine.breach", self._breach)
+        cluster_bus.register("alarm_engine.clear", self._clear)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="alarm-repeats", daemon=True
+            )
+            self._thread.start()
+
+    def load(self):
+        rules = {row[0]: AlarmRule(*row) for row in self._query()}
+        breached = {
+            row.id: row.breached_at.isoformat()
+            for row in db.session.query(Alarm.id, Alarm.breached_at).filter(
+                Alarm.breached_at.isnot(None)
+            )
+        }
+        with self._lock:
+            self._rules = rules
+            self._breached = breached
+            self._reindex()
+            self._loaded = True
+
+    def refresh(self, *ids):
+        rows = self._query(ids)
+        if rows:
+            cluster_bus.publish("alarm_engine.update", rows)
+        missing = set(ids).difference(row[0] for row in rows)
+        if missing:
+            self.remove(*missing)
+
+    def remove(self, *ids):
+        cluster_bus.publish("alarm_engine.remove", *ids)
+
+    def evaluate(self, device_id, serie_number, values):
+        if not self._loaded:
+            self.load()
+        entered = []
+        left = []
+        for field, value in values.items():
+            rules = self._index.get((device_id, field))
+            if not rules or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            for rule in rules:
+                self.evaluated += 1
+                breached = (rule.min_value is not None and value < rule.min_value) or (
+                    rule.max_value is not None and value > rule.max_value
+                )
+                # only transitions touch the database, steady readings stay in memory
+                if breached and rule.id not in self._breached:
+                    entered.append((rule, value))
+                elif not breached and rule.id in self._breached:
+                    left.append(rule.id)
+        for rule, value in entered:
+            self._enter(rule, serie_number, value)
+        for id in left:
+            self._leave(id)
+
+    def stats(self):
+        return {
+            "rules": len(self._rules),
+            "breached": len(self._breached),
+            "scheduled": len(self._heap),
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+            "repeated": self.repeated,
+        }
+
+    def _query(self, ids=None):
+        query = db.session.query(*[getattr(Alarm, name) for name in AlarmRule._fields])
+        if ids is not None:
+            query = query.filter(Alarm.id.in_(list(ids)))
+        query = query.filter(Alarm.active.is_(True), Alarm.field.isnot(None))
+        return [tuple(row) for row in query]
+
+    def _reindex(self):
+        index = {}
+        for rule in self._rules.values():
+            index.setdefault((rule.device_id, rule.field), []).append(rule)
+        self._index = {key: tuple(rules) for key, rules in index.items()}
+
+    def _enter(self, rule, serie_number, value):
+        # readings of one device reach different workers in cluster mode; the
+        # conditional update lets exactly one of them own each breach episode
+        breached_at = datetime.utcnow()
+        claimed = db.session.execute(
+            Alarm.__table__.update()
+            .where(Alarm.id == rule.id, Alarm.breached_at.is_(None))
+            .values(breached_at=breached_at)
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            with self._lock:
+                self._breached.setdefault(rule.id, None)
+            return
+        token = breached_at.isoformat()
+        cluster_bus.publish("alarm_engine.breach", rule.id, token)
+        if (rule.repeatitions or 0) > 1 and rule.repeatitions_interval:
+            with self._lock:
+                self._schedule(
+                    time.monotonic() + rule.repeatitions_interval,
+                    token,
+                    rule.id,
+                    2,
+                    serie_number,
+                    value,
+                )
+        self._fire(rule, serie_number, value, 1)
+
+    def _leave(self, id):
+        db.session.execute(
+            Alarm.__table__.update()
+            .where(Alarm.id == id, Alarm.breached_at.isnot(None))
+            .values(breached_at=None)
+        )
+        db.session.commit()
+        cluster_bus.publish("alarm_engine.clear", id)
+
+    def _still_breached(self, id, token):
+        with app.app_context():
+            return (
+                db.session.query(Alarm.id)
+                .filter(Alarm.id == id, Alarm.breached_at == datetime.fromisoformat(token))
+                .first()
+                is not None
+            )
+
+    def _update(self, rows):
+        with self._lock:
+            for row in rows:
+                rule = AlarmRule(*row)
+                self._rules[rule.id] = rule
+                self._breached.pop(rule.id, None)
+            self._reindex()
+
+    def _remove(self, *ids):
+        with self._lock:
+            for id in ids:
+                self._rules.pop(id, None)
+                self._breached.pop(id, None)
+            self._reindex()
+
+    def _breach(self, id, token):
+        with self._lock:
+            self._breached[id] = token
+
+    def _clear(self, id):
+        with self._lock:
+            self._breached.pop(id, None)
+
+    def _schedule(self, due, token, id, repetition, serie_number, value):
+        heapq.heappush(self._heap, (due, token, id, repetition, serie_number, value))
+        if self._heap[0][1] == token and self._heap[0][2] == id:
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while not self._heap or self._heap[0][0] > now:
+                    self._wakeup.wait(self._heap[0][0] - now if self._heap else None)
+                    now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, token, id, repetition, serie_number, value = heapq.heappop(self._heap)
+                    rule = self._rules.get(id)
+                    # cleared, edited or removed rules drop their pending repeats
+                    if rule is None or self._breached.get(id) != token:
+                        continue
+                    due.append((rule, token, serie_number, value, repetition))
+                    if repetition < rule.repeatitions:
+                        self._schedule(
+                            now + rule.repeatitions_interval,
+                            token,
+                            id,
+                            repetition + 1,
+                            serie_number,
+                            value,
+                        )
+            for rule, token, serie_number, value, repetition in due:
+                try:
+                    if not self._still_breached(rule.id, token):
+                        with self._lock:
+                            if self._breached.get(rule.id) == token:
+                                self._breached.pop(rule.id)
+                        continue
+                    self.repeated += 1
+                    self._fire(rule, serie_number, value, repetition)
+                except Exception as e:
+                    print("Error repeating alarm", rule.id, e)
+
+    def _fire(self, rule, serie_number, value, repetition):
+        self.fired += 1
+        if rule.light or rule.sound:
+            command = {
+                "command": self.command,
+                "alarm_id": rule.id,
+                "light": bool(rule.light),
+                "light_duration": rule.light_duration,
+                "sound": bool(rule.sound),
+                "sound_duration": rule.sound_duration,
+            }
+            command["hash"] = pending_commands.register(self.command, serie_number)
+            mqtt_client.publish(
+                f"{COMMAND_TOPIC}{serie_number}",
+                payload_codec.encode(serie_number, command),
+            )
+        if rule.inform_to_user:
+            socketio.emit(
+                "alarm",
+                {
+                    "alarm_id": rule.id,
+                    "serie_number": serie_number,
+                    "field": rule.field,
+                    "value": value,
+                    "min_value": rule.min_value,
+                    "max_value": rule.max_value,
+                    "repetition": repetition,
+                },
+                to=device_room(serie_number),
+            )
+
+
+alarm_engine = AlarmEngine(app.config["ALARM_COMMAND"])
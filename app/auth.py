@@ -1,14 +1,17 @@
 # pyright: reportOptionalSubscript=false
-import time
 from datetime import timedelta
 
 from flask import abort, jsonify, request
 from flask_jwt_extended import create_access_token, decode_token, jwt_required
 from flask_restx import Namespace, Resource, fields
-from jwt import decode
+from jwt import InvalidTokenError
+from werkzeug.exceptions import HTTPException
 
-from app import app, db_configs
+from app import app
+from app.cache import login_users
 from app.database import User, db
+from app.google_auth import verify_google_token
+from app.serializers import user_serializer
 
 api = Namespace("auth", description="Auth CRUD")
 auth_model = api.model("AuthModel", {"token": fields.String})
@@ -22,34 +25,45 @@ class AuthView(Resource):
         try:
             if request.json and secret_key:
                 token = request.json.get("token", None)
-                infos = decode(token, options={"verify_signature": False})
-                if infos.get("exp", 0) > time.time():
-                    if infos.get("aud") == db_configs.google_client_id:
-                        user = User.query.filter(
-                            User.email == infos.get("email")
-                        ).first()
-                        if not user:
-                            try:
-                                user = User()
-                                user.name = infos.get("name")
-                                user.email = infos.get("email")
-                                user.picture = infos.get("picture")
-                                db.session.add(user)
-                                db.session.commit()
-                            except:
-                                abort(500)
-
-                        access_token = create_access_token(identity=user.email, expires_delta=timedelta(hours=1))
-                        res = {
-                            "id": user.id,
-                            "email": user.email,
-                            "picture": user.picture,
-                            "name": user.name,
-                            "token": f"Bearer {access_token}",
-                        }
-
-                        return jsonify(res)
+                infos = verify_google_token(token)
+                email = infos.get("email")
+                user = login_users.get(email)
+                if user is None:
+                    row = (
+                        db.session.query(*user_serializer.columns)
+                        .filter(User.email == email)
+                        .first()
+                    )
+                    if row:
+                        user = user_serializer.row(row)
+                    else:
+                        try:
+                            new_user = User()
+                            new_user.name = infos.get("name")
+                            new_user.email = email
+                            new_user.picture = infos.get("picture")
+                            db.session.add(new_user)
+                            db.session.commit()
+                            user = user_serializer(new_user)
+                        except:
+                            abort(500)
+                    login_users.set(email, user)
+
+                access_token = create_access_token(identity=user["email"], expires_delta=timedelta(hours=1))
+                res = {
+                    "id": user["id"],
+                    "email": user["email"],
+                    "picture": user["picture"],
+                    "name": user["name"],
+                    "token": f"Bearer {access_token}",
+                }
+
+                return jsonify(res)
             return abort(404, "Error")
+        except InvalidTokenError:
+            return abort(401, "Invalid token")
+        except HTTPException:
+            raise
         except Exception as e:
             return abort(500, "Error")
 
@@ -0,0 +1,351 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.cluster import cluster_bus
+from app.database import (Device, DeviceAction, DeviceType, db, on_primary,
+                          users_devices)
+from app.serializers import (catalog_action_serializer,
+                             catalog_field_serializer,
+                             device_action_param_serializer,
+                             device_type_serializer)
+
+
+CATALOG_TABLES = ("device_type", "device_action", "device_action_param", "device_field")
+
+
+class TableVersions:
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        cluster_bus.register("table_versions.bump", self._bump)
+
+    def get(self, *tables):
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def bump(self, *tables):
+        cluster_bus.publish("table_versions.bump", *tables)
+
+    def _bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+class CatalogCache:
+    def __init__(self, versions):
+        self.versions = versions
+        self._catalog = None
+        self._catalog_version = None
+
+    @property
+    def version(self):
+        return self.versions.get(*CATALOG_TABLES)
+
+    def get(self):
+        version = self.version
+        catalog = self._catalog
+        if catalog is None or self._catalog_version != version:
+            catalog = self._load()
+            self._catalog, self._catalog_version = catalog, version
+        return catalog
+
+    def get_type(self, id):
+        return self.get().get(id)
+
+    def _load(self):
+        with on_primary():
+            device_types = (
+                DeviceType.query.options(
+                    joinedload(DeviceType.actions).joinedload(DeviceAction.params),
+                    selectinload(DeviceType.fields),
+                )
+                .order_by(DeviceType.id)
+                .all()
+            )
+        catalog = {}
+        for device_type in device_types:
+            catalog[device_type.id] = dict(
+                device_type_serializer(device_type),
+                actions=[
+                    dict(
+                        catalog_action_serializer(action),
+                        params=[
+                            device_action_param_serializer(param)
+                            for param in action.params
+                        ],
+                    )
+                    for action in device_type.actions
+                ],
+                fields=[
+                    catalog_field_serializer(field) for field in device_type.fields
+                ],
+            )
+        return catalog
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+PARAM_COERCERS = {
+    "int": int,
+    "integer": int,
+    "float": float,
+    "double": float,
+    "number": float,
+    "bool": _to_bool,
+    "boolean": _to_bool,
+    "str": str,
+    "string": str,
+}
+
+
+class CommandTemplate:
+    __slots__ = ("id", "name", "function", "device_type", "params")
+
+    def __init__(self, action, device_type):
+        self.id = action["id"]
+        self.name = action["name"]
+        self.function = action["function"]
+        self.device_type = device_type
+        self.params = {
+            param["id"]: (
+                param["name"],
+                PARAM_COERCERS.get((param["param_type"] or "").lower()),
+            )
+            for param in action["params"]
+        }
+
+    def build(self, hash, params):
+        command = {"hash": hash, "command": self.function}
+        for param in params:
+            name, coerce = self.params[param["param_id"]]
+            value = param["value"]
+            command[name] = coerce(value) if coerce and value is not None else value
+        return command
+
+
+class CommandTemplateCache:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._version = None
+        self._templates = {}
+
+    def get(self, action_id):
+        if self._version != self.catalog.version:
+            self._compile()
+        return self._templates.get(action_id)
+
+    def _compile(self):
+        version = self.catalog.version
+        self._templates = {
+            action["id"]: CommandTemplate(action, device_type["id"])
+            for device_type in self.catalog.get().values()
+            for action in device_type["actions"]
+        }
+        self._version = version
+
+
+class DeviceSerialCache:
+    def __init__(self):
+        self.version = 0
+        self._devices = {}
+        self._lock = threading.Lock()
+        cluster_bus.register("device_serials.invalidate", self._invalidate)
+
+    def get(self, id):
+        device = self._devices.get(id)
+        if device is None:
+            version = self.version
+            with on_primary():
+                device = (
+                    db.session.query(Device.serie_number, Device.alias_name)
+                    .filter(Device.id == id)
+                    .first()
+                )
+            if device is not None:
+                device = tuple(device)
+                with self._lock:
+                    if self.version == version:
+                        self._devices[id] = device
+        return device
+
+    def invalidate(self, id=None):
+        cluster_bus.publish("device_serials.invalidate", id)
+
+    def _invalidate(self, id=None):
+        with self._lock:
+            self.version += 1
+            if id is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(id, None)
+
+
+class TTLCache:
+    def __init__(self, name, ttl, max_size):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        cluster_bus.register(f"{name}.invalidate", self._invalidate)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        cluster_bus.publish(f"{self.name}.invalidate", key)
+
+    def _invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+ResolvedDevice = namedtuple("ResolvedDevice", ("id", "device_type", "owners"))
+
+
+class SerialResolver:
+    def __init__(self, negative_ttl, max_unknown, chunk_size=1000):
+        self.negative_ttl = negative_ttl
+        self.max_unknown = max_unknown
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._devices = {}
+        self._unknown = OrderedDict()
+        self._warmed = False
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        cluster_bus.register("serial_resolver.update", self._update)
+        cluster_bus.register("serial_resolver.forget", self._forget)
+
+    def warm(self):
+        with self._warm_lock:
+            if self._warmed:
+                return
+            devices = {
+                serie_number: ResolvedDevice(*device)
+                for serie_number, *device in self._query()
+            }
+            with self._lock:
+                # entries pushed while the query ran are newer than its snapshot
+                devices.update(self._devices)
+                self._devices = devices
+                self._warmed = True
+
+    def get(self, serie_number):
+        device = self._devices.get(serie_number)
+        if device is not None:
+            self.hits += 1
+            return device
+        if not self._warmed:
+            self.warm()
+            device = self._devices.get(serie_number)
+            if device is not None:
+                self.hits += 1
+                return device
+        # unknown serials only reach the database once per negative_ttl
+        expires = self._unknown.get(serie_number)
+        if expires is not None and expires > time.monotonic():
+            self.rejected += 1
+            return None
+        self.misses += 1
+        rows = self._query([serie_number])
+        if rows:
+            self._update(rows)
+            return self._devices.get(serie_number)
+        with self._lock:
+            self._unknown[serie_number] = time.monotonic() + self.negative_ttl
+            self._unknown.move_to_end(serie_number)
+            while len(self._unknown) > self.max_unknown:
+                self._unknown.popitem(last=False)
+        return None
+
+    def refresh(self, *serie_numbers):
+        rows = self._query(serie_numbers)
+        if rows:
+            cluster_bus.publish("serial_resolver.update", rows)
+        missing = set(serie_numbers).difference(row[0] for row in rows)
+        if missing:
+            self.forget(*missing)
+
+    def forget(self, *serie_numbers):
+        cluster_bus.publish("serial_resolver.forget", *serie_numbers)
+
+    def stats(self):
+        return {
+            "devices": len(self._devices),
+            "unknown": len(self._unknown),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+        }
+
+    def _query(self, serie_numbers=None):
+        query = (
+            db.session.query(
+                Device.serie_number,
+                Device.id,
+                Device.device_type,
+                func.array_remove(func.array_agg(users_devices.c.user_id), None),
+            )
+            .outerjoin(users_devices, users_devices.c.device_id == Device.id)
+            .group_by(Device.id)
+        )
+        if serie_numbers is None:
+            rows = query.all()
+        else:
+            serie_numbers = list(serie_numbers)
+            rows = []
+            for start in range(0, len(serie_numbers), self.chunk_size):
+                rows += query.filter(
+                    Device.serie_number.in_(serie_numbers[start : start + self.chunk_size])
+                ).all()
+        return [
+            (serie_number, id, device_type, tuple(owners))
+            for serie_number, id, device_type, owners in rows
+        ]
+
+    def _update(self, rows):
+        with self._lock:
+            for serie_number, id, device_type, owners in rows:
+                self._devices[serie_number] = ResolvedDevice(id, device_type, tuple(owners))
+                self._unknown.pop(serie_number, None)
+
+    def _forget(self, *serie_numbers):
+        with self._lock:
+            for serie_number in serie_numbers:
+                self._devices.pop(serie_number, None)
+
+
+table_versions = TableVersions()
+catalog_cache = CatalogCache(table_versions)
+command_templates = CommandTemplateCache(catalog_cache)
+device_serials = DeviceSerialCache()
+login_users = TTLCache("login_users", ttl=300, max_size=10000)
+serial_resolver = SerialResolver(negative_ttl=60, max_unknown=100000)
@@ -0,0 +1,40 @@
+import json
+import secrets
+
+from app import app, mqtt_client
+
+CLUSTER_TOPIC = "iot-backend/cluster"
+
+
+class ClusterBus:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.node = secrets.token_hex(4)
+        self._handlers = {}
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def publish(self, kind, *args):
+        self._handlers[kind](*args)
+        self.share(kind, *args)
+
+    def share(self, kind, *args):
+        # peers only, for state the caller has already applied locally
+        if self.enabled:
+            mqtt_client.publish(
+                CLUSTER_TOPIC,
+                json.dumps({"node": self.node, "kind": kind, "args": args}),
+                qos=1,
+            )
+
+    def receive(self, payload):
+        message = json.loads(payload)
+        if message.get("node") == self.node:
+            return
+        handler = self._handlers.get(message.get("kind"))
+        if handler is not None:
+            handler(*message.get("args", ()))
+
+
+cluster_bus = ClusterBus(app.config["CLUSTER_MODE"])
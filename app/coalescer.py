@@ -0,0 +1,67 @@
+import threading
+import time
+
+from app import app, socketio
+from app.rooms import device_room
+
+
+class ValuesCoalescer:
+    def __init__(self, emit, window):
+        self.emit = emit
+        self.window = window
+        self.received = 0
+        self.emitted = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def push(self, serie_number, values):
+        if self.window <= 0:
+            self.received += 1
+            self.emitted += 1
+            self.emit(serie_number, values)
+            return
+        with self._lock:
+            self.received += 1
+            pending = self._pending.get(serie_number)
+            if pending is None:
+                self._pending[serie_number] = dict(values)
+            else:
+                pending.update(values)
+        if self._thread is None:
+            self._start()
+        self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.emitted += len(pending)
+        for serie_number, values in pending.items():
+            self.emit(serie_number, values)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="values-coalescer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.window)
+            self._wakeup.clear()
+            self.flush()
+
+
+def emit_values(serie_number, values):
+    socketio.emit(
+        "values",
+        {"msg": {"serie_number": serie_number, "values": values}},
+        to=device_room(serie_number),
+    )
+
+
+values_coalescer = ValuesCoalescer(emit_values, app.config["VALUES_COALESCE_MS"] / 1000)
@@ -0,0 +1,144 @@
+import json
+import struct
+
+from app.cache import catalog_cache
+from app.cluster import cluster_bus
+from app.serializers import dumps
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+JSON = "json"
+MSGPACK = "msgpack"
+CBOR = "cbor"
+STRUCT = "struct"
+
+STRUCT_MAGIC = 0x01
+STRUCT_CODES = {
+    "int": "i",
+    "integer": "i",
+    "float": "f",
+    "double": "d",
+    "number": "d",
+    "bool": "?",
+    "boolean": "?",
+}
+
+
+def sniff(view):
+    # every format starts with a map header, and the header ranges don't overlap
+    first = view[0]
+    if first == STRUCT_MAGIC:
+        return STRUCT
+    if 0x80 <= first <= 0x8F or first in (0xDE, 0xDF):
+        return MSGPACK
+    if 0xA0 <= first <= 0xBB or first == 0xBF:
+        return CBOR
+    return JSON
+
+
+class StructLayouts:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._version = None
+        self._layouts = {}
+
+    def get(self, device_type):
+        if self._version != self.catalog.version:
+            self._compile()
+        return self._layouts.get(device_type)
+
+    def _compile(self):
+        version = self.catalog.version
+        layouts = {}
+        for device_type in self.catalog.get().values():
+            # string fields have no fixed width and are left out of the layout
+            fields = [
+                (field["name"], STRUCT_CODES[(field["field_type"] or "").lower()])
+                for field in device_type["fields"]
+                if (field["field_type"] or "").lower() in STRUCT_CODES
+            ]
+            layouts[device_type["id"]] = (
+                tuple(name for name, _ in fields),
+                struct.Struct("<" + "".join(code for _, code in fields)),
+            )
+        self._layouts = layouts
+        self._version = version
+
+
+class PayloadCodec:
+    def __init__(self, layouts):
+        self.layouts = layouts
+        self.formats = {}
+        cluster_bus.register("payload_codec.format", self._set_format)
+        cluster_bus.register("payload_codec.forget", self._forget)
+
+    def decode_values(self, serie_number, payload, device_type=None):
+        view = memoryview(payload)
+        format = sniff(view)
+        if format == STRUCT:
+            layout = self.layouts.get(device_type)
+            if layout is None:
+                raise ValueError(f"No struct layout for {serie_number}")
+            names, packer = layout
+            values = dict(zip(names, packer.unpack_from(view, 1)))
+        else:
+            values = self._decode(format, view)
+        if self.formats.get(serie_number, JSON) != format:
+            cluster_bus.publish("payload_codec.format", serie_number, format)
+        return values
+
+    def decode(self, payload):
+        view = memoryview(payload)
+        format = sniff(view)
+        if format == STRUCT:
+            raise ValueError("Struct payloads are only accepted on the values topic")
+        return self._decode(format, view)
+
+    def encode(self, serie_number, value):
+        # struct devices have no layout for commands and get JSON
+        format = self.formats.get(serie_number, JSON)
+        if format == MSGPACK and msgpack is not None:
+            return msgpack.packb(value)
+        if format == CBOR and cbor2 is not None:
+            return cbor2.dumps(value)
+        return dumps(value)
+
+    def forget(self, serie_number):
+        cluster_bus.publish("payload_codec.forget", serie_number)
+
+    def _decode(self, format, view):
+        if format == MSGPACK:
+            if msgpack is None:
+                raise ValueError("msgpack is not installed")
+            return msgpack.unpackb(view, raw=False)
+        if format == CBOR:
+            if cbor2 is None:
+                raise ValueError("cbor2 is not installed")
+            return cbor2.loads(view)
+        if orjson is not None:
+            return orjson.loads(view)
+        return json.loads(view.tobytes())
+
+    def _set_format(self, serie_number, format):
+        self.formats[serie_number] = format
+
+    def _forget(self, serie_number):
+        self.formats.pop(serie_number, None)
+
+
+struct_layouts = StructLayouts(catalog_cache)
+payload_codec = PayloadCodec(struct_layouts)
@@ -0,0 +1,159 @@
+import heapq
+import secrets
+import threading
+import time
+from bisect import bisect_left
+
+from app import app, socketio
+from app.rooms import device_room
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class PendingCommands:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.completed = 0
+        self.timeouts = 0
+        self.evicted = 0
+        self._pending = {}
+        self._heap = []
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="pending-commands", daemon=True
+            )
+            self._thread.start()
+
+    def register(self, function, serie_number):
+        now = time.monotonic()
+        with self._lock:
+            expired = self._make_room(1)
+            hash = self._new_hash()
+            self._add(hash, function, serie_number, now)
+        self._notify_timeouts(expired)
+        return hash
+
+    def register_many(self, function, serie_numbers):
+        now = time.monotonic()
+        with self._lock:
+            expired = self._make_room(len(serie_numbers))
+            hashes = []
+            for serie_number in serie_numbers:
+                hash = self._new_hash()
+                self._add(hash, function, serie_number, now)
+                hashes.append(hash)
+        self._notify_timeouts(expired)
+        return hashes
+
+    def complete(self, hash, serie_number):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.get(hash)
+            if entry is None or entry[1] != serie_number:
+                return None
+            del self._pending[hash]
+            function, _, sent_at, _ = entry
+            latency = (now - sent_at) * 1000
+            histogram = self._latencies.get(function)
+            if histogram is None:
+                histogram = self._latencies[function] = [
+                    [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    0.0,
+                ]
+            histogram[0][bisect_left(LATENCY_BUCKETS_MS, latency)] += 1
+            histogram[1] += latency
+            self.completed += 1
+        return function, latency
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "evicted": self.evicted,
+                "latency_ms": {
+                    function: {
+                        "buckets": dict(
+                            zip(
+                                [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"],
+                                counts,
+                            )
+                        ),
+                        "count": sum(counts),
+                        "sum": total,
+                    }
+                    for function, (counts, total) in self._latencies.items()
+                },
+            }
+
+    def _new_hash(self):
+        hash = secrets.token_hex(8)
+        while hash in self._pending:
+            hash = secrets.token_hex(8)
+        return hash
+
+    def _add(self, hash, function, serie_number, now):
+        deadline = now + self.ttl
+        self._pending[hash] = (function, serie_number, now, deadline)
+        heapq.heappush(self._heap, (deadline, hash))
+        if len(self._heap) == 1:
+            self._wakeup.notify()
+
+    def _make_room(self, count):
+        expired = []
+        while self._heap and len(self._pending) + count > self.max_size:
+            entry = self._pop()
+            if entry is not None:
+                expired.append(entry)
+                self.evicted += 1
+        return expired
+
+    def _pop(self):
+        deadline, hash = heapq.heappop(self._heap)
+        entry = self._pending.get(hash)
+        if entry is None or entry[3] != deadline:
+            return None
+        del self._pending[hash]
+        return hash, entry
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while not self._heap or self._heap[0][0] > now:
+                    self._wakeup.wait(self._heap[0][0] - now if self._heap else None)
+                    now = time.monotonic()
+                expired = []
+                while self._heap and self._heap[0][0] <= now:
+                    entry = self._pop()
+                    if entry is not None:
+                        expired.append(entry)
+                        self.timeouts += 1
+            self._notify_timeouts(expired)
+
+    def _notify_timeouts(self, expired):
+        for hash, (function, serie_number, _, _) in expired:
+            socketio.emit(
+                "command",
+                {
+                    "command": function,
+                    "serie_number": serie_number,
+                    "hash": hash,
+                    "result": None,
+                    "timeout": True,
+                },
+                to=device_room(serie_number),
+            )
+
+
+pending_commands = PendingCommands(
+    app.config["COMMAND_MAX_PENDING"], app.config["COMMAND_TIMEOUT"]
+)
@@ -0,0 +1,36 @@
+import secrets
+from functools import wraps
+from hashlib import blake2b
+
+from flask import make_response, request
+
+from app.cache import table_versions
+
+# restarts must never reuse a tag for different content
+PROCESS_EPOCH = secrets.token_hex(4)
+
+CATALOG_CACHE_CONTROL = "private, max-age=60, must-revalidate"
+DEVICE_CACHE_CONTROL = "private, no-cache"
+
+
+def conditional(*tables, cache_control="private, no-cache"):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # computed from in-memory counters only, so a 304 never touches the database
+            versions = "-".join(str(version) for version in table_versions.get(*tables))
+            key = blake2b(
+                f"{request.full_path}|{sorted(kwargs.items())}".encode(), digest_size=8
+            ).hexdigest()
+            etag = f"{PROCESS_EPOCH}-{versions}-{key}"
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = cache_control
+            return response
+
+        return wrapper
+
+    return decorator
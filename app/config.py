@@ -1,8 +1,11 @@
 # pyright: reportOptionalSubscript=false
-from flask import abort, jsonify, request
+from flask import abort, request
 from flask_restx import Namespace, Resource, fields
 
-from app.database import Config, db
+from app.database import Config, db, users_devices
+from app.dose import dose_scheduler
+from app.pagination import int_arg, keyset, page_args, stream_page
+from app.serializers import config_serializer, json_response
 
 api = Namespace("config", description="Config CRUD")
 
@@ -22,109 +25,67 @@ config_model = api.model(
 
 @api.route("", methods=["GET", "POST"])
 class ConfigView(Resource):
+    @api.doc(
+        params={
+            "limit": "Page size",
+            "after": "Return configs with id greater than this cursor",
+            "device_id": "Device id",
+            "user_id": "Owner user id of the device",
+        }
+    )
     def get(self):
-        configs = Config.query.paginate(1, 10).items
-        res = []
-        for config in configs:
-            res.append(
-                {
-                    "id": config.id,
-                    "hour": config.hour,
-                    "minute": config.minute,
-                    "start_time": config.start_time,
-                    "end_time": config.end_time,
-                    "active": config.active,
-                    "slot": config.slot,
-                    "device_id": config.device_id,
-                }
-            )
-        return jsonify(res)
+        limit, after = page_args()
+        query = db.session.query(*config_serializer.columns)
+        if request.args.get("device_id"):
+            query = query.filter(Config.device_id == int_arg("device_id"))
+        if request.args.get("user_id"):
+            query = query.join(
+                users_devices, users_devices.c.device_id == Config.device_id
+            ).filter(users_devices.c.user_id == int_arg("user_id"))
+        return stream_page(
+            keyset(query, Config.id, limit, after).all(), limit, config_serializer.row
+        )
 
     @api.expect(config_model)
     def post(self):
         config = Config()
         for param in config.columns():
-            if param != "id":
+            if param not in ("id", "last_fired"):
                 setattr(config, param, request.json[param])
         db.session.add(config)
         db.session.commit()
 
         self.add_config(config)
 
-        return jsonify(
-            {
-                "id": config.id,
-                "hour": config.hour,
-                "minute": config.minute,
-                "start_time": config.start_time,
-                "end_time": config.end_time,
-                "active": config.active,
-                "slot": config.slot,
-                "device_id": config.device_id,
-            }
-        )
+        return json_response(config_serializer(config))
 
     def add_config(self, config):
-        pass
-        # device = Device.query.filter_by(id=config.device_id).first()
-
-        # publish(f'devices/{device.serie_number}/configs/add', dumps({'values': [{
-        #     'slot': config.slot,
-        #     'hour': config.hour,
-        #     'minute': config.minute,
-        #     'start_time': config.start_time,
-        #     'end_time': config.end_time,
-        #     'active': config.active
-        # }]}))
+        dose_scheduler.refresh(config.id)
 
     def delete_config(self, config):
-        pass
-        # device = Device.query.filter_by(id=config.device_id).first()
-
-        # publish(f'devices/{device.serie_number}/configs/delete', dumps({'values': [{
-        #     'slot': config.slot
-        # }]}))
+        dose_scheduler.remove(config.id)
 
 
 @api.route("/<int:id>", methods=["GET", "PATCH", "DELETE"])
 class ConfigIdView(Resource):
     def get(self, id):
-        config = Config.query.filter_by(id=id).first()
+        config = (
+            db.session.query(*config_serializer.columns).filter(Config.id == id).first()
+        )
         if not config:
             abort(404)
-        res = {
-            "id": config.id,
-            "hour": config.hour,
-            "minute": config.minute,
-            "start_time": config.start_time,
-            "end_time": config.end_time,
-            "active": config.active,
-            "slot": config.slot,
-            "device_id": config.device_id,
-        }
-        return jsonify(res)
+        return json_response(config_serializer.row(config))
 
     @api.expect(config_model)
     def patch(self, id):
         config = Config.query.filter_by(id=id).first()
         for param in config.columns():
-            if param in request.json:
+            if param != "last_fired" and param in request.json:
                 setattr(config, param, request.json[param])
         db.session.add(config)
         db.session.commit()
         self.add_config(config)
-        return jsonify(
-            {
-                "id": config.id,
-                "hour": config.hour,
-                "minute": config.minute,
-                "start_time": config.start_time,
-                "end_time": config.end_time,
-                "active": config.active,
-                "slot": config.slot,
-                "device_id": config.device_id,
-            }
-        )
+        return json_response(config_serializer(config))
 
     def delete(self, id):
         config = db.session.query(Config).filter(Config.id == id).first()
@@ -136,22 +97,7 @@ class ConfigIdView(Resource):
         return "OK"
 
     def add_config(self, config):
-        pass
-        # device = Device.query.filter_by(id=config.device_id).first()
-
-        # publish(f'devices/{device.serie_number}/configs/add', dumps({'values': [{
-        #     'slot': config.slot,
-        #     'hour': config.hour,
-        #     'minute': config.minute,
-        #     'start_time': config.start_time,
-        #     'end_time': config.end_time,
-        #     'active': config.active
-        # }]}))
+        dose_scheduler.refresh(config.id)
 
     def delete_config(self, config):
-        pass
-        # device = Device.query.filter_by(id=config.device_id).first()
-
-        # publish(f'devices/{device.serie_number}/configs/delete', dumps({'values': [{
-        #     'slot': config.slot
-        # }]}))
+        dose_scheduler.remove(config.id)
@@ -1,5 +1,12 @@
 # type: ignore
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
 
 from app import app, db_configs
 
@@ -7,7 +14,107 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config[
     "SQLALCHEMY_DATABASE_URI"
 ] = f"postgresql://{db_configs.user}:{db_configs.password}@{db_configs.host}:{db_configs.port}/{db_configs.database}"
-db = SQLAlchemy(app)
+if db_configs.replica_host:
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": f"postgresql://{db_configs.user}:{db_configs.password}@{db_configs.replica_host}:{db_configs.replica_port}/{db_configs.database}"
+    }
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": db_configs.pool_size,
+    "max_overflow": db_configs.pool_max_overflow,
+    "pool_timeout": db_configs.pool_timeout,
+    "pool_recycle": db_configs.pool_recycle,
+    "pool_pre_ping": db_configs.pool_pre_ping,
+}
+if db_configs.statement_timeout:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
+        "options": f"-c statement_timeout={db_configs.statement_timeout}"
+    }
+
+recent_writers = {}
+recent_writers_lock = threading.Lock()
+
+
+def _current_identity():
+    try:
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._use_replica(clause):
+            return self.db.get_engine(self.app, bind="replica")
+        return super().get_bind(mapper, clause)
+
+    def commit(self):
+        super().commit()
+        # read-your-writes: this session, and the writer's next requests, stay on the primary
+        self.info["primary"] = True
+        identity = _current_identity() if has_request_context() else None
+        if identity is not None:
+            now = time.monotonic()
+            with recent_writers_lock:
+                if len(recent_writers) > 10000:
+                    for key, sticky_until in list(recent_writers.items()):
+                        if sticky_until <= now:
+                            del recent_writers[key]
+                recent_writers[identity] = now + db_configs.replica_sticky_seconds
+
+    def _use_replica(self, clause):
+        if (
+            "replica" not in (self.app.config.get("SQLALCHEMY_BINDS") or {})
+            or self._flushing
+            or self.info.get("primary")
+            or not getattr(clause, "is_select", False)
+            or not has_request_context()
+            or request.method not in ("GET", "HEAD")
+        ):
+            return False
+        identity = _current_identity()
+        if identity is not None:
+            sticky_until = recent_writers.get(identity)
+            if sticky_until is not None:
+                if sticky_until > time.monotonic():
+                    return False
+                with recent_writers_lock:
+                    recent_writers.pop(identity, None)
+        return True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy(app)
+
+
+@contextmanager
+def on_primary():
+    # shared caches must never be filled from a replica that lags behind a write
+    info = db.session.info
+    sticky = info.get("primary")
+    info["primary"] = True
+    try:
+        yield
+    finally:
+        if not sticky:
+            info.pop("primary", None)
+
+
+class ColumnsMixin:
+    @classmethod
+    def column_names(cls):
+        names = cls.__dict__.get("_column_names")
+        if names is None:
+            names = cls._column_names = tuple(
+                column.name for column in cls.__table__.columns
+            )
+        return names
+
+    def columns(self):
+        return {name: getattr(self, name, None) for name in self.column_names()}
 
 
 class Auth(db.Model):
@@ -31,10 +138,11 @@ users_devices = db.Table(
     "users_devices",
     db.Column("user_id", db.Integer, db.ForeignKey("user.id"), primary_key=True),
     db.Column("device_id", db.Integer, db.ForeignKey("device.id"), primary_key=True),
+    db.Index("ix_users_devices_device_id", "device_id"),
 )
 
 
-class User(db.Model):
+class User(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True)
     name = db.Column(db.String(100))
@@ -42,102 +150,86 @@ class User(db.Model):
     devices = db.relationship(
         "Device",
         secondary=users_devices,
-        lazy="subquery",
+        lazy="select",
         cascade="all,delete",
         backref=db.backref("users", lazy=True),
     )
 
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
-
     def __repr__(self):
         return "<User %d>" % self.id
 
 
-class Device(db.Model):
+class Device(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     alias_name = db.Column(db.String(50), nullable=False)
     serie_number = db.Column(db.String(50), unique=True, nullable=False)
     firmware_version = db.Column(db.String(20))
-    device_type = db.Column(db.Integer, db.ForeignKey("device_type.id"))
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    device_type = db.Column(db.Integer, db.ForeignKey("device_type.id"), index=True)
 
     def __repr__(self):
         return "<Device %r>" % self.id
 
 
-class DeviceType(db.Model):
+class DeviceType(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True, nullable=False)
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    actions = db.relationship(
+        "DeviceAction", lazy=True, passive_deletes="all", order_by="DeviceAction.id"
+    )
+    fields = db.relationship(
+        "DeviceField", lazy=True, passive_deletes="all", order_by="DeviceField.id"
+    )
 
     def __repr__(self):
         return "<DeviceType %r>" % self.id
 
 
-class DeviceField(db.Model):
+class DeviceField(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     field_type = db.Column(db.String(20), nullable=False)
+    # unit of stored and emitted values; reported_unit is what the device sends
     unit = db.Column(db.String(20))
-    device_type = db.Column(db.Integer, db.ForeignKey("device_type.id"), nullable=False)
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    reported_unit = db.Column(db.String(20))
+    device_type = db.Column(
+        db.Integer, db.ForeignKey("device_type.id"), nullable=False, index=True
+    )
 
     def __repr__(self):
         return "<DeviceField %r>" % self.id
 
 
-class DeviceAction(db.Model):
+class DeviceAction(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     function = db.Column(db.String(20), nullable=False)
-    device_type = db.Column(db.Integer, db.ForeignKey("device_type.id"), nullable=False)
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    device_type = db.Column(
+        db.Integer, db.ForeignKey("device_type.id"), nullable=False, index=True
+    )
+    params = db.relationship(
+        "DeviceActionParam",
+        lazy=True,
+        passive_deletes="all",
+        order_by="DeviceActionParam.id",
+    )
 
     def __repr__(self):
         return "<DeviceAction %r>" % self.username
 
 
-class DeviceActionParam(db.Model):
+class DeviceActionParam(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     param_type = db.Column(db.String(20), nullable=False)
-    action = db.Column(db.Integer, db.ForeignKey("device_action.id"), nullable=False)
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    action = db.Column(
+        db.Integer, db.ForeignKey("device_action.id"), nullable=False, index=True
+    )
 
     def __repr__(self):
         return "<DeviceActionParam %r>" % self.id
 
 
-class Config(db.Model):
+class Config(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     hour = db.Column(db.Integer)
     minute = db.Column(db.Integer)
@@ -145,19 +237,16 @@ class Config(db.Model):
     end_time = db.Column(db.DateTime())
     active = db.Column(db.Boolean)
     slot = db.Column(db.Integer)
-    device_id = db.Column(db.Integer, db.ForeignKey("device.id"), nullable=False)
-
-    def columns(self):
-        return {
-            column.name: getattr(self, column.name, None)
-            for column in self.__table__.columns
-        }
+    last_fired = db.Column(db.DateTime())
+    device_id = db.Column(
+        db.Integer, db.ForeignKey("device.id"), nullable=False, index=True
+    )
 
     def __repr__(self):
         return "<Config %d>" % self.id
 
 
-class Alarm(db.Model):
+class Alarm(ColumnsMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     minutes = db.Column(db.Integer)
     hours = db.Column(db.Integer)
@@ -168,7 +257,34 @@ class Alarm(db.Model):
     sound = db.Column(db.Boolean)
     sound_duration = db.Column(db.Integer)
     inform_to_user = db.Column(db.Boolean)
-    device_id = db.Column(db.Integer, db.ForeignKey("device.id"), nullable=False)
+    field = db.Column(db.String(50))
+    min_value = db.Column(db.Float)
+    max_value = db.Column(db.Float)
+    active = db.Column(db.Boolean, default=True, server_default=db.true())
+    breached_at = db.Column(db.DateTime())
+    device_id = db.Column(
+        db.Integer, db.ForeignKey("device.id"), nullable=False, index=True
+    )
 
     def __repr__(self):
         return "<Alarm %d>" % self.id
+
+
+class Telemetry(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    serie_number = db.Column(db.String(50), nullable=False)
+    field = db.Column(db.String(50), nullable=False)
+    timestamp = db.Column(db.DateTime(), nullable=False)
+    value = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index(
+            "ix_telemetry_serie_number_field_timestamp",
+            "serie_number",
+            "field",
+            "timestamp",
+        ),
+    )
+
+    def __repr__(self):
+        return "<Telemetry %d>" % self.id
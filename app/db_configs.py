@@ -10,3 +10,17 @@ host = environ.get("SERVER_HOST")
 port = environ.get("SERVER_PORT")
 database = environ.get("SERVER_DB")
 google_client_id = environ.get("GOOGLE_CLIENT_ID")
+replica_host = environ.get("SERVER_REPLICA_HOST")
+replica_port = environ.get("SERVER_REPLICA_PORT") or port
+
+pool_size = int(environ.get("DB_POOL_SIZE") or 5)
+pool_max_overflow = int(environ.get("DB_POOL_MAX_OVERFLOW") or 10)
+pool_timeout = float(environ.get("DB_POOL_TIMEOUT") or 30)
+pool_recycle = int(environ.get("DB_POOL_RECYCLE") or 1800)
+pool_pre_ping = (environ.get("DB_POOL_PRE_PING") or "true").lower() == "true"
+statement_timeout = int(environ.get("DB_STATEMENT_TIMEOUT_MS") or 0)
+replica_sticky_seconds = float(environ.get("DB_REPLICA_STICKY_SECONDS") or 5)
+
+google_jwks_url = environ.get("GOOGLE_JWKS_URL") or "https://www.googleapis.com/oauth2/v3/certs"
+google_jwks_file = environ.get("GOOGLE_JWKS_FILE")
+google_jwks_cache = environ.get("GOOGLE_JWKS_CACHE")
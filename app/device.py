@@ -1,18 +1,35 @@
 # pyright: reportOptionalSubscript=false
-from datetime import datetime
+import csv
+import io
 import json
-from random import random, seed
+from datetime import datetime, timedelta, timezone
+from math import ceil
 
-from flask import abort, jsonify, request
+from flask import abort, request
 from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource, fields
+from sqlalchemy import BigInteger, cast, func, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert
 
-from app import COMMAND_TOPIC, mqtt_client, commands_awaiting
-from app.database import (Device, DeviceAction, DeviceActionParam, User, db,
-                          users_devices)
+from app import COMMAND_TOPIC, mqtt_client
+from app.cache import (catalog_cache, command_templates, device_serials,
+                       serial_resolver, table_versions)
+from app.codecs import payload_codec
+from app.commands import pending_commands
+from app.conditional import DEVICE_CACHE_CONTROL, conditional
+from app.database import Device, Telemetry, User, db, users_devices
+from app.pagination import int_arg, keyset, page_args, stream_page
+from app.recent import recent_readings
+from app.rooms import room_index
+from app.serializers import device_serializer, json_response
 
-
-seed(datetime.now().timestamp())
+BULK_MAX_ROWS = 20000
+BULK_CHUNK_SIZE = 1000
+BULK_COLUMN_LENGTHS = {
+    name: Device.__table__.c[name].type.length
+    for name in ("serie_number", "alias_name", "firmware_version")
+}
+MAX_INTEGER = 2**31 - 1
 
 api = Namespace("device", description="Device CRUD")
 api_command = Namespace("device/command", description="Device CRUD command")
@@ -42,25 +59,47 @@ command_model = api.model(
     }
 )
 
+bulk_command_model = api.model(
+    "BulkCommandModel", {
+        "command_id": fields.Integer,
+        "params": fields.List(fields.Nested(command_param_model)),
+        "device_ids": fields.List(fields.Integer),
+        "device_type": fields.Integer,
+        "user_id": fields.Integer,
+    }
+)
+
 
 @api.route("/", methods=["GET", "POST"])
 class DeviceView(Resource):
-    @api.doc(security="Bearer")
+    @api.doc(
+        security="Bearer",
+        params={
+            "limit": "Page size",
+            "after": "Return devices with id greater than this cursor",
+            "device_type": "Device type id",
+            "user_id": "Owner user id",
+            "serie_number": "Serie number prefix",
+        },
+    )
     @jwt_required()
+    @conditional("device", "users_devices", cache_control=DEVICE_CACHE_CONTROL)
     def get(self):
-        devices = Device.query.all()
-        res = []
-        for device in devices:
-            res.append(
-                {
-                    "id": device.id,
-                    "serie_number": device.serie_number,
-                    "alias_name": device.alias_name,
-                    "firmware_version": device.firmware_version,
-                    "device_type": device.device_type,
-                }
+        limit, after = page_args()
+        query = db.session.query(*device_serializer.columns)
+        if request.args.get("device_type"):
+            query = query.filter(Device.device_type == int_arg("device_type"))
+        if request.args.get("user_id"):
+            query = query.join(
+                users_devices, users_devices.c.device_id == Device.id
+            ).filter(users_devices.c.user_id == int_arg("user_id"))
+        if request.args.get("serie_number"):
+            query = query.filter(
+                Device.serie_number.startswith(request.args["serie_number"], autoescape=True)
             )
-        return jsonify(res)
+        return stream_page(
+            keyset(query, Device.id, limit, after).all(), limit, device_serializer.row
+        )
 
     @api.expect(device_model)
     @api.doc(security="Bearer")
@@ -77,53 +116,168 @@ class DeviceView(Resource):
             users_devices.insert(), params={"user_id": user.id, "device_id": device.id}
         )
         db.session.commit()
-        return jsonify(
-            {
-                "id": device.id,
-                "serie_number": device.serie_number,
-                "alias_name": device.alias_name,
-                "firmware_version": device.firmware_version,
-                "device_type": device.device_type,
+        table_versions.bump("device", "users_devices")
+        serial_resolver.refresh(device.serie_number)
+        room_index.link(user.id, device.serie_number)
+        return json_response(device_serializer(device))
+
+
+@api.route("/bulk", methods=["POST"])
+class DeviceBulkView(Resource):
+    @api.doc(
+        security="Bearer",
+        description="JSON list, JSON lines (application/x-ndjson) or CSV (text/csv) "
+        "rows with serie_number, alias_name, firmware_version, device_type and "
+        "user_id or user_ids (';' separated in CSV)",
+    )
+    @jwt_required()
+    def post(self):
+        try:
+            rows = DeviceUtils.parseBulkRows()
+        except (ValueError, csv.Error):
+            abort(400, "Invalid bulk payload")
+        if len(rows) > BULK_MAX_ROWS:
+            abort(413, f"At most {BULK_MAX_ROWS} devices per request")
+
+        errors = []
+        valid = []
+        seen = set()
+        for index, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                errors.append({"row": index, "error": "Row is not an object"})
+                continue
+            serie_number = str(row.get("serie_number") or "").strip()
+            try:
+                device = {
+                    "serie_number": serie_number,
+                    "alias_name": str(row.get("alias_name") or "").strip(),
+                    "firmware_version": str(row.get("firmware_version") or "").strip() or None,
+                    "device_type": int(row["device_type"]) if row.get("device_type") not in (None, "") else None,
+                }
+                user_ids = DeviceUtils.parseUserIds(row)
+            except (TypeError, ValueError):
+                errors.append({"row": index, "serie_number": serie_number, "error": "Invalid device_type or user id"})
+                continue
+            too_long = [
+                f"{name} is longer than {length} characters"
+                for name, length in BULK_COLUMN_LENGTHS.items()
+                if device[name] is not None and len(device[name]) > length
+            ]
+            if not device["serie_number"] or not device["alias_name"]:
+                error = "serie_number and alias_name are required"
+            elif too_long:
+                error = ", ".join(too_long)
+            elif device["device_type"] is not None and not catalog_cache.get_type(device["device_type"]):
+                error = "Unknown device_type"
+            elif serie_number in seen:
+                error = "Duplicate serie_number in batch"
+            else:
+                error = None
+            if error:
+                errors.append({"row": index, "serie_number": serie_number, "error": error})
+                continue
+            seen.add(serie_number)
+            valid.append((index, device, user_ids))
+
+        existing = set()
+        known_users = set()
+        if valid:
+            existing = {
+                row.serie_number
+                for row in db.session.query(Device.serie_number).filter(
+                    Device.serie_number.in_([device["serie_number"] for _, device, _ in valid])
+                )
             }
-        )
+            user_ids = {user_id for _, _, ids in valid for user_id in ids}
+            if user_ids:
+                known_users = {
+                    row.id for row in db.session.query(User.id).filter(User.id.in_(user_ids))
+                }
+
+        pending = []
+        for index, device, ids in valid:
+            if device["serie_number"] in existing:
+                errors.append({"row": index, "serie_number": device["serie_number"], "error": "serie_number already exists"})
+            elif not ids.issubset(known_users):
+                errors.append({"row": index, "serie_number": device["serie_number"], "error": "Unknown user_id"})
+            else:
+                pending.append((index, device, ids))
+
+        created = []
+        links = []
+        for start in range(0, len(pending), BULK_CHUNK_SIZE):
+            chunk = pending[start : start + BULK_CHUNK_SIZE]
+            inserted = {
+                row.serie_number: row.id
+                for row in db.session.execute(
+                    insert(Device.__table__)
+                    .values([device for _, device, _ in chunk])
+                    .on_conflict_do_nothing(index_elements=["serie_number"])
+                    .returning(Device.__table__.c.id, Device.__table__.c.serie_number)
+                )
+            }
+            for index, device, ids in chunk:
+                device_id = inserted.get(device["serie_number"])
+                if device_id is None:
+                    errors.append({"row": index, "serie_number": device["serie_number"], "error": "serie_number already exists"})
+                    continue
+                created.append({"row": index, "id": device_id, "serie_number": device["serie_number"]})
+                links += [
+                    {"user_id": user_id, "device_id": device_id, "serie_number": device["serie_number"]}
+                    for user_id in ids
+                ]
+        for start in range(0, len(links), BULK_CHUNK_SIZE):
+            db.session.execute(
+                users_devices.insert().values(
+                    [
+                        {"user_id": link["user_id"], "device_id": link["device_id"]}
+                        for link in links[start : start + BULK_CHUNK_SIZE]
+                    ]
+                )
+            )
+        db.session.commit()
+        table_versions.bump("device", "users_devices")
+        if created:
+            serial_resolver.refresh(*[device["serie_number"] for device in created])
+
+        for link in links:
+            room_index.link(link["user_id"], link["serie_number"])
+        errors.sort(key=lambda error: error["row"])
+        return json_response({"created": created, "errors": errors})
 
 
 @api.route("/<int:id>", methods=["GET", "PATCH", "DELETE"])
 class DeviceIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
+    @conditional("device", cache_control=DEVICE_CACHE_CONTROL)
     def get(self, id):
-        device = Device.query.filter_by(id=id).first()
+        device = (
+            db.session.query(*device_serializer.columns).filter(Device.id == id).first()
+        )
         if not device:
             abort(404)
-        res = {
-            "id": device.id,
-            "serie_number": device.serie_number,
-            "alias_name": device.alias_name,
-            "firmware_version": device.firmware_version,
-            "device_type": device.device_type,
-        }
-        return jsonify(res)
+        return json_response(device_serializer.row(device))
 
     @api.expect(device_model)
     @api.doc(security="Bearer")
     @jwt_required()
     def patch(self, id):
         device = Device.query.filter_by(id=id).first()
+        serie_number = device.serie_number
         for param in device.columns():
             if param in request.json:
                 setattr(device, param, request.json[param])
         db.session.add(device)
         db.session.commit()
-        return jsonify(
-            {
-                "id": device.id,
-                "serie_number": device.serie_number,
-                "alias_name": device.alias_name,
-                "firmware_version": device.firmware_version,
-                "device_type": device.device_type,
-            }
-        )
+        table_versions.bump("device")
+        device_serials.invalidate(id)
+        payload_codec.forget(serie_number)
+        serial_resolver.refresh(device.serie_number)
+        if device.serie_number != serie_number:
+            serial_resolver.forget(serie_number)
+            room_index.rename_device(serie_number, device.serie_number)
+        return json_response(device_serializer(device))
 
     @api.doc(security="Bearer")
     @jwt_required()
@@ -131,14 +285,165 @@ class DeviceIdView(Resource):
         device = db.session.query(Device).filter(Device.id == id).first()
         db.session.delete(device)
         db.session.commit()
+        table_versions.bump("device", "users_devices")
+        device_serials.invalidate(id)
+        recent_readings.forget(device.serie_number)
+        payload_codec.forget(device.serie_number)
+        serial_resolver.forget(device.serie_number)
+        room_index.unlink_device(device.serie_number)
         return
 
 
+@api.route("/<int:id>/recent", methods=["GET"])
+class DeviceRecentView(Resource):
+    @api.doc(
+        security="Bearer",
+        params={
+            "field": "Field name, may be repeated",
+            "limit": "Maximum number of readings per field",
+        },
+    )
+    @jwt_required()
+    def get(self, id):
+        device = device_serials.get(id)
+        if not device:
+            abort(404)
+        serie_number = device[0]
+        try:
+            limit = int(request.args["limit"]) if "limit" in request.args else None
+        except ValueError:
+            abort(400, "Invalid limit")
+        return json_response(
+            {
+                "serie_number": serie_number,
+                "fields": recent_readings.latest(
+                    serie_number, request.args.getlist("field"), limit
+                ),
+            }
+        )
+
+
+@api.route("/<int:id>/telemetry", methods=["GET"])
+class DeviceTelemetryView(Resource):
+    @api.doc(
+        security="Bearer",
+        params={
+            "field": "Field name",
+            "start": "ISO datetime, defaults to one day before end",
+            "end": "ISO datetime, defaults to now",
+            "bucket": "Bucket width in seconds",
+            "max_points": "Maximum number of buckets returned",
+        },
+    )
+    @jwt_required()
+    def get(self, id):
+        device = device_serials.get(id)
+        if not device:
+            abort(404)
+        serie_number = device[0]
+        field = request.args.get("field")
+        if not field:
+            abort(400, "field is required")
+        try:
+            end = DeviceUtils.parseDatetime(request.args.get("end")) or datetime.utcnow()
+            start = DeviceUtils.parseDatetime(request.args.get("start")) or end - timedelta(days=1)
+            bucket = int(request.args.get("bucket") or 0)
+            max_points = min(int(request.args.get("max_points") or 500), 5000)
+        except ValueError:
+            abort(400, "Invalid telemetry query")
+        if start >= end or max_points < 1:
+            abort(400, "Invalid telemetry query")
+
+        span = (end - start).total_seconds()
+        if bucket < 1 or span / bucket > max_points:
+            bucket = max(ceil(span / max_points), 1)
+
+        # EXTRACT returns numeric on PostgreSQL 14+, which would come back as Decimal
+        bucket_expr = cast(
+            func.floor(func.extract("epoch", Telemetry.timestamp) / bucket), BigInteger
+        )
+        rows = (
+            db.session.query(
+                bucket_expr.label("bucket"),
+                func.min(Telemetry.value),
+                func.max(Telemetry.value),
+                func.avg(Telemetry.value),
+                func.count(Telemetry.value),
+                array_agg(aggregate_order_by(Telemetry.value, Telemetry.timestamp.desc()))[1],
+            )
+            .filter(
+                Telemetry.serie_number == serie_number,
+                Telemetry.field == field,
+                Telemetry.timestamp >= start,
+                Telemetry.timestamp < end,
+            )
+            .group_by(literal_column("bucket"))
+            .order_by(literal_column("bucket"))
+            .all()
+        )
+        return json_response(
+            {
+                "serie_number": serie_number,
+                "field": field,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "bucket": bucket,
+                "buckets": [
+                    {
+                        "time": datetime.utcfromtimestamp(row[0] * bucket).isoformat(),
+                        "min": row[1],
+                        "max": row[2],
+                        "avg": float(row[3]) if row[3] is not None else None,
+                        "count": row[4],
+                        "last": row[5],
+                    }
+                    for row in rows
+                ],
+            }
+        )
+
+
 class DeviceUtils():
     @staticmethod
     def sortParams(value):
         return value["order"]
 
+    @staticmethod
+    def parseBulkRows():
+        content_type = request.mimetype
+        body = request.get_data(as_text=True)
+        if content_type == "text/csv":
+            return list(csv.DictReader(io.StringIO(body)))
+        if content_type in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        rows = json.loads(body)
+        if isinstance(rows, dict):
+            rows = rows.get("devices")
+        if not isinstance(rows, list):
+            raise ValueError("Expected a list of devices")
+        return rows
+
+    @staticmethod
+    def parseUserIds(row):
+        user_ids = row.get("user_ids")
+        if user_ids is None or user_ids == "":
+            user_ids = [row["user_id"]] if row.get("user_id") not in (None, "") else []
+        elif isinstance(user_ids, str):
+            user_ids = [user_id for user_id in user_ids.split(";") if user_id.strip()]
+        user_ids = {int(user_id) for user_id in user_ids}
+        if any(not 0 < user_id <= MAX_INTEGER for user_id in user_ids):
+            raise ValueError("user id out of range")
+        return user_ids
+
+    @staticmethod
+    def parseDatetime(value):
+        if not value:
+            return None
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
 
 @api_command.route("/<int:id>", methods=["POST"])
 class DeviceCommandView(Resource):
@@ -146,28 +451,93 @@ class DeviceCommandView(Resource):
     @jwt_required()
     @api.expect(command_model)
     def post(self, id):
-        device = Device.query.filter_by(id=id).first()
-        device_action = DeviceAction.query.filter_by(id=request.json["command_id"]).first()
+        device = device_serials.get(id)
+        template = command_templates.get(request.json["command_id"])
+        if not device or not template:
+            abort(404)
+        serie_number, alias_name = device
 
-        topic = f'{COMMAND_TOPIC}{device.serie_number}'
+        topic = f'{COMMAND_TOPIC}{serie_number}'
 
-        command = {
-            "hash": str(int(random()*10e15)),
-            "command": device_action.function
-        }
-        for param in request.json["params"]:
-            action_param = DeviceActionParam.query.filter_by(id=param["param_id"]).first()
-            command[action_param.name] = param["value"]
+        try:
+            command = template.build(None, request.json["params"])
+        except KeyError:
+            abort(400, "Unknown command param")
+        except (TypeError, ValueError):
+            abort(400, "Invalid command param value")
 
-        commands_awaiting[command["hash"]] = device_action.function
+        command["hash"] = pending_commands.register(template.function, serie_number)
 
-        publish_result = mqtt_client.publish(topic, json.dumps(command, indent=4).encode('utf-8'))
-        return jsonify(
+        publish_result = mqtt_client.publish(topic, payload_codec.encode(serie_number, command))
+        return json_response(
             {
                 "result": True,
                 "topic": topic,
                 "command": command,
-                "result": publish_result,
-                "message": f'Comando {device_action.name} enviado ao dispositivo {device.alias_name}',
+                "result": list(publish_result),
+                "message": f'Comando {template.name} enviado ao dispositivo {alias_name}',
+            }
+        )
+
+
+@api_command.route("/bulk", methods=["POST"])
+class DeviceBulkCommandView(Resource):
+    @api.doc(security="Bearer")
+    @jwt_required()
+    @api.expect(bulk_command_model)
+    def post(self):
+        template = command_templates.get(request.json["command_id"])
+        if not template:
+            abort(404)
+        device_ids = request.json.get("device_ids")
+        device_type = request.json.get("device_type")
+        user_id = request.json.get("user_id")
+        if not device_ids and device_type is None and user_id is None:
+            abort(400, "device_ids, device_type or user_id is required")
+
+        try:
+            command = template.build(None, request.json.get("params") or [])
+        except KeyError:
+            abort(400, "Unknown command param")
+        except (TypeError, ValueError):
+            abort(400, "Invalid command param value")
+
+        query = db.session.query(Device.id, Device.serie_number).filter(
+            Device.device_type == template.device_type
+        )
+        if device_ids:
+            query = query.filter(Device.id.in_(device_ids))
+        if device_type is not None:
+            query = query.filter(Device.device_type == device_type)
+        if user_id is not None:
+            query = query.join(
+                users_devices, users_devices.c.device_id == Device.id
+            ).filter(users_devices.c.user_id == user_id)
+        targets = query.order_by(Device.id).all()
+
+        hashes = pending_commands.register_many(
+            template.function, [target.serie_number for target in targets]
+        )
+        sent = []
+        for target, hash in zip(targets, hashes):
+            command["hash"] = hash
+            topic = f'{COMMAND_TOPIC}{target.serie_number}'
+            publish_result = mqtt_client.publish(
+                topic, payload_codec.encode(target.serie_number, command)
+            )
+            sent.append(
+                {
+                    "id": target.id,
+                    "serie_number": target.serie_number,
+                    "hash": hash,
+                    "result": publish_result[0],
+                }
+            )
+        return json_response(
+            {
+                "result": True,
+                "command": template.function,
+                "sent": sent,
+                "message": f'Comando {template.name} enviado a {len(sent)} dispositivos',
             }
         )
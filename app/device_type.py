@@ -1,11 +1,18 @@
 # pyright: reportOptionalSubscript=false
-from flask import abort, jsonify, request
+from flask import abort, request
 from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource, fields
 
+from app.cache import CATALOG_TABLES, catalog_cache, table_versions
+from app.conditional import CATALOG_CACHE_CONTROL, conditional
 from app.database import (DeviceAction, DeviceActionParam, DeviceField,
                           DeviceType, db)
 from app.device import DeviceUtils
+from app.pagination import page_args, stream_page
+from app.schema import normalize_unit
+from app.serializers import (device_action_param_serializer,
+                             device_action_serializer, device_field_serializer,
+                             device_type_serializer, json_response)
 
 api = Namespace("device_type", description="Device Type CRUD")
 api_action_param = Namespace(
@@ -41,6 +48,7 @@ device_field_model = api.model(
         "id": fields.Integer,
         "name": fields.String,
         "unit": fields.String,
+        "reported_unit": fields.String(readonly=True),
         "field_type": fields.String,
         "device_type": fields.Integer,
     },
@@ -58,24 +66,25 @@ device_type_model = api.model(
 
 @api.route("/", methods=["GET", "POST"])
 class DeviceTypeView(Resource):
-    @api.doc(security="Bearer")
+    @api.doc(
+        security="Bearer",
+        params={
+            "limit": "Page size",
+            "after": "Return device types with id greater than this cursor",
+        },
+    )
     @jwt_required()
+    @conditional(*CATALOG_TABLES, cache_control=CATALOG_CACHE_CONTROL)
     def get(self):
-        device_types = DeviceType.query.all()
-        res = []
-        for device_type in device_types:
-            device_actions, device_fields = DeviceTypeUtils().getActionsFields(
-                device_type.id
-            )
-            res.append(
-                {
-                    "id": device_type.id,
-                    "name": device_type.name,
-                    "actions": device_actions,
-                    "fields": device_fields,
-                }
-            )
-        return jsonify(res)
+        limit, after = page_args()
+        device_types = [
+            device_type
+            for id, device_type in catalog_cache.get().items()
+            if after is None or id > after
+        ][:limit]
+        return stream_page(
+            device_types, limit, lambda item: item, lambda item: item["id"]
+        )
 
     @api.expect(device_type_model)
     @api.doc(security="Bearer")
@@ -87,16 +96,16 @@ class DeviceTypeView(Resource):
                 setattr(device_type, param, request.json[param])
         db.session.add(device_type)
         db.session.commit()
+        table_versions.bump("device_type")
         device_actions, device_fields = DeviceTypeUtils().getActionsFields(
             device_type.id
         )
-        return jsonify(
-            {
-                "id": device_type.id,
-                "name": device_type.name,
-                "actions": device_actions,
-                "fields": device_fields,
-            }
+        return json_response(
+            dict(
+                device_type_serializer(device_type),
+                actions=device_actions,
+                fields=device_fields,
+            )
         )
 
 
@@ -104,21 +113,12 @@ class DeviceTypeView(Resource):
 class DeviceTypeIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
+    @conditional(*CATALOG_TABLES, cache_control=CATALOG_CACHE_CONTROL)
     def get(self, id):
-        device_type = DeviceType.query.filter_by(id=id).first()
+        device_type = catalog_cache.get_type(id)
         if not device_type:
             abort(404)
-        device_actions, device_fields = DeviceTypeUtils().getActionsFields(
-            device_type.id
-        )
-        return jsonify(
-            {
-                "id": device_type.id,
-                "name": device_type.name,
-                "actions": device_actions,
-                "fields": device_fields,
-            }
-        )
+        return json_response(device_type)
 
     @api.expect(device_type_model)
     @api.doc(security="Bearer")
@@ -130,16 +130,16 @@ class DeviceTypeIdView(Resource):
                 setattr(device_type, param, request.json[param])
         db.session.add(device_type)
         db.session.commit()
+        table_versions.bump("device_type")
         device_actions, device_fields = DeviceTypeUtils().getActionsFields(
             device_type.id
         )
-        return jsonify(
-            {
-                "id": device_type.id,
-                "name": device_type.name,
-                "actions": device_actions,
-                "fields": device_fields,
-            }
+        return json_response(
+            dict(
+                device_type_serializer(device_type),
+                actions=device_actions,
+                fields=device_fields,
+            )
         )
 
     @api.doc(security="Bearer")
@@ -148,6 +148,7 @@ class DeviceTypeIdView(Resource):
         device_type = db.session.query(DeviceType).filter(DeviceType.id == id).first()
         db.session.delete(device_type)
         db.session.commit()
+        table_versions.bump("device_type")
         return
 
 
@@ -163,15 +164,10 @@ class DeviceTypeActionView(Resource):
                 setattr(device_action, param, request.json[param])
         db.session.add(device_action)
         db.session.commit()
+        table_versions.bump("device_action")
         action_params = DeviceTypeUtils().getActionParamsFields(device_action.id)
-        return jsonify(
-            {
-                "id": device_action.id,
-                "name": device_action.name,
-                "function": device_action.function,
-                "device_type": device_action.device_type,
-                "params": action_params,
-            }
+        return json_response(
+            dict(device_action_serializer(device_action), params=action_params)
         )
 
 
@@ -179,19 +175,14 @@ class DeviceTypeActionView(Resource):
 class DeviceTypeActionIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
+    @conditional(*CATALOG_TABLES, cache_control=CATALOG_CACHE_CONTROL)
     def get(self, id):
         device_action = DeviceAction.query.filter_by(id=id).first()
         if not device_action:
             abort(404)
         action_params = DeviceTypeUtils().getActionParamsFields(device_action.id)
-        return jsonify(
-            {
-                "id": device_action.id,
-                "name": device_action.name,
-                "function": device_action.function,
-                "device_type": device_action.device_type,
-                "params": action_params,
-            }
+        return json_response(
+            dict(device_action_serializer(device_action), params=action_params)
         )
 
     @api_action.expect(device_action_model)
@@ -204,15 +195,10 @@ class DeviceTypeActionIdView(Resource):
                 setattr(device_action, param, request.json[param])
         db.session.add(device_action)
         db.session.commit()
+        table_versions.bump("device_action")
         action_params = DeviceTypeUtils().getActionParamsFields(device_action.id)
-        return jsonify(
-            {
-                "id": device_action.id,
-                "name": device_action.name,
-                "function": device_action.function,
-                "device_type": device_action.device_type,
-                "params": action_params,
-            }
+        return json_response(
+            dict(device_action_serializer(device_action), params=action_params)
         )
 
     @api.doc(security="Bearer")
@@ -223,6 +209,7 @@ class DeviceTypeActionIdView(Resource):
         )
         db.session.delete(device_action)
         db.session.commit()
+        table_versions.bump("device_action")
         return
 
 
@@ -238,32 +225,20 @@ class DeviceTypeActionParamView(Resource):
                 setattr(action_param, param, request.json[param])
         db.session.add(action_param)
         db.session.commit()
-        return jsonify(
-            {
-                "id": action_param.id,
-                "name": action_param.name,
-                "param_type": action_param.param_type,
-                "action": action_param.action,
-            }
-        )
+        table_versions.bump("device_action_param")
+        return json_response(device_action_param_serializer(action_param))
 
 
 @api_action_param.route("/<int:id>", methods=["GET", "PATCH", "DELETE"])
 class DeviceTypeActionParamIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
+    @conditional(*CATALOG_TABLES, cache_control=CATALOG_CACHE_CONTROL)
     def get(self, id):
         action_param = DeviceActionParam.query.filter_by(id=id).first()
         if not action_param:
             abort(404)
-        return jsonify(
-            {
-                "id": action_param.id,
-                "name": action_param.name,
-                "param_type": action_param.param_type,
-                "action": action_param.action,
-            }
-        )
+        return json_response(device_action_param_serializer(action_param))
 
     @api_action_param.expect(device_action_param_model)
     @api.doc(security="Bearer")
@@ -275,14 +250,8 @@ class DeviceTypeActionParamIdView(Resource):
                 setattr(action_param, param, request.json[param])
         db.session.add(action_param)
         db.session.commit()
-        return jsonify(
-            {
-                "id": action_param.id,
-                "name": action_param.name,
-                "param_type": action_param.param_type,
-                "action": action_param.action,
-            }
-        )
+        table_versions.bump("device_action_param")
+        return json_response(device_action_param_serializer(action_param))
 
     @api.doc(security="Bearer")
     @jwt_required()
@@ -294,6 +263,7 @@ class DeviceTypeActionParamIdView(Resource):
         )
         db.session.delete(action_param)
         db.session.commit()
+        table_versions.bump("device_action_param")
         return
 
 
@@ -305,38 +275,25 @@ class DeviceTypeFieldView(Resource):
     def post(self):
         device_field = DeviceField()
         for param in device_field.columns():
-            if param != "id":
+            if param not in ("id", "reported_unit"):
                 setattr(device_field, param, request.json[param])
+        device_field.unit, device_field.reported_unit = normalize_unit(device_field.unit)
         db.session.add(device_field)
         db.session.commit()
-        return jsonify(
-            {
-                "id": device_field.id,
-                "name": device_field.name,
-                "unit": device_field.unit,
-                "field_type": device_field.field_type,
-                "device_type": device_field.device_type,
-            }
-        )
+        table_versions.bump("device_field")
+        return json_response(device_field_serializer(device_field))
 
 
 @api_field.route("/<int:id>", methods=["GET", "PATCH", "DELETE"])
 class DeviceTypeFieldIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
+    @conditional(*CATALOG_TABLES, cache_control=CATALOG_CACHE_CONTROL)
     def get(self, id):
         device_field = DeviceField.query.filter_by(id=id).first()
         if not device_field:
             abort(404)
-        return jsonify(
-            {
-                "id": device_field.id,
-                "name": device_field.name,
-                "unit": device_field.unit,
-                "field_type": device_field.field_type,
-                "device_type": device_field.device_type,
-            }
-        )
+        return json_response(device_field_serializer(device_field))
 
     @api_field.expect(device_field_model)
     @api.doc(security="Bearer")
@@ -344,19 +301,17 @@ class DeviceTypeFieldIdView(Resource):
     def patch(self, id):
         device_field = DeviceField.query.filter_by(id=id).first()
         for param in device_field.columns():
-            if param in request.json:
+            if param in request.json and param not in ("unit", "reported_unit"):
                 setattr(device_field, param, request.json[param])
+        # sending back the published canonical unit keeps the reported one
+        if "unit" in request.json and request.json["unit"] != device_field.unit:
+            device_field.unit, device_field.reported_unit = normalize_unit(
+                request.json["unit"]
+            )
         db.session.add(device_field)
         db.session.commit()
-        return jsonify(
-            {
-                "id": device_field.id,
-                "name": device_field.name,
-                "unit": device_field.unit,
-                "field_type": device_field.field_type,
-                "device_type": device_field.device_type,
-            }
-        )
+        table_versions.bump("device_field")
+        return json_response(device_field_serializer(device_field))
 
     @api.doc(security="Bearer")
     @jwt_required()
@@ -366,43 +321,21 @@ class DeviceTypeFieldIdView(Resource):
         )
         db.session.delete(device_field)
         db.session.commit()
+        table_versions.bump("device_field")
         return
 
 
 class DeviceTypeUtils(Resource):
     def getActionParamsFields(self, id):
-        params = DeviceActionParam.query.filter_by(action=id).all()
-        action_params = []
-        for param in params:
-            action_param = {
-                "id": param.id,
-                "name": param.name,
-                "param_type": param.param_type,
-                "action": param.action,
-            }
-            action_params.append(action_param)
-        return action_params
+        params = (
+            db.session.query(*device_action_param_serializer.columns)
+            .filter(DeviceActionParam.action == id)
+            .order_by(DeviceActionParam.id)
+        )
+        return [device_action_param_serializer.row(param) for param in params]
 
     def getActionsFields(self, id):
-        actions = DeviceAction.query.filter_by(device_type=id).all()
-        device_actions = []
-        for action in actions:
-            action_params = self.getActionParamsFields(action.id)
-            device_action = {
-                "id": action.id,
-                "name": action.name,
-                "function": action.function,
-                "params": action_params,
-            }
-            device_actions.append(device_action)
-        fields = DeviceField.query.filter_by(device_type=id).all()
-        device_fields = []
-        for field in fields:
-            device_field = {
-                "id": field.id,
-                "name": field.name,
-                "unit": field.unit,
-                "field_type": field.field_type,
-            }
-            device_fields.append(device_field)
-        return (device_actions, device_fields)
+        device_type = catalog_cache.get_type(id)
+        if not device_type:
+            return ([], [])
+        return (device_type["actions"], device_type["fields"])
@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import or_
+
+from app import COMMAND_TOPIC, app, mqtt_client
+from app.cache import device_serials
+from app.cluster import cluster_bus
+from app.codecs import payload_codec
+from app.commands import pending_commands
+from app.database import Config, db
+
+DoseSlot = namedtuple(
+    "DoseSlot",
+    ("id", "hour", "minute", "start_time", "end_time", "slot", "device_id", "last_fired"),
+)
+
+SLOT_COLUMNS = tuple(getattr(Config, name) for name in DoseSlot._fields)
+
+
+def _timestamp(value):
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else None
+
+
+class DoseScheduler:
+    def __init__(self, command, tz, grace):
+        self.command = command
+        self.tz = tz
+        self.grace = grace
+        self.fired = 0
+        self.skipped = 0
+        self._slots = {}
+        self._due = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        cluster_bus.register("dose_scheduler.update", self._update)
+        cluster_bus.register("dose_scheduler.remove", self._remove)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="dose-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def load(self):
+        rows = self._query()
+        with self._lock:
+            self._slots.clear()
+            self._due.clear()
+            self._heap = []
+            # only a restart may fire doses that came due while nothing was running
+            self._update_locked(rows, self.grace)
+
+    def refresh(self, *ids):
+        rows = self._query(ids)
+        if rows:
+            cluster_bus.publish("dose_scheduler.update", rows)
+        missing = set(ids).difference(row[0] for row in rows)
+        if missing:
+            self.remove(*missing)
+
+    def remove(self, *ids):
+        cluster_bus.publish("dose_scheduler.remove", *ids)
+
+    def stats(self):
+        return {
+            "slots": len(self._slots),
+            "scheduled": len(self._due),
+            "fired": self.fired,
+            "skipped": self.skipped,
+        }
+
+    def next_due(self, slot, now, grace=0):
+        after = max(now - grace, slot.last_fired or 0)
+        if slot.start_time is not None:
+            after = max(after, slot.start_time - 1)
+        local = datetime.fromtimestamp(after, self.tz)
+        due = local.replace(hour=slot.hour, minute=slot.minute, second=0, microsecond=0)
+        if due.timestamp() <= after:
+            due = (due + timedelta(days=1)).replace(hour=slot.hour, minute=slot.minute)
+        due = due.timestamp()
+        if slot.end_time is not None and due > slot.end_time:
+            return None
+        return due
+
+    def _query(self, ids=None):
+        query = db.session.query(*SLOT_COLUMNS).filter(
+            Config.active.is_(True), Config.hour.isnot(None), Config.minute.isnot(None)
+        )
+        if ids is not None:
+            query = query.filter(Config.id.in_(list(ids)))
+        return [
+            (
+                row.id,
+                row.hour,
+                row.minute,
+                _timestamp(row.start_time),
+                _timestamp(row.end_time),
+                row.slot,
+                row.device_id,
+                _timestamp(row.last_fired),
+            )
+            for row in query
+        ]
+
+    def _update(self, rows):
+        with self._lock:
+            self._update_locked(rows)
+
+    def _update_locked(self, rows, grace=0):
+        now = time.time()
+        for row in rows:
+            slot = DoseSlot(*row)
+            self._slots[slot.id] = slot
+            self._schedule(slot, now, grace)
+
+    def _remove(self, *ids):
+        with self._lock:
+            for id in ids:
+                self._slots.pop(id, None)
+                self._due.pop(id, None)
+
+    def _schedule(self, slot, now, grace=0):
+        due = self.next_due(slot, now, grace)
+        if due is None:
+            self._due.pop(slot.id, None)
+            return
+        # superseded heap entries are skipped when they surface
+        self._due[slot.id] = due
+        heapq.heappush(self._heap, (due, next(self._sequence), slot.id))
+        if self._heap[0][2] == slot.id:
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                while not self._heap or self._heap[0][0] > now:
+                    self._wakeup.wait(self._heap[0][0] - now if self._heap else None)
+                    now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    at, _, id = heapq.heappop(self._heap)
+                    slot = self._slots.get(id)
+                    if slot is None or self._due.get(id) != at:
+                        continue
+                    slot = self._slots[id] = slot._replace(last_fired=at)
+                    self._schedule(slot, now)
+                    due.append((slot, at))
+            for slot, at in due:
+                try:
+                    self._fire(slot, at)
+                except Exception as e:
+                    print("Error firing dose", slot.id, e)
+
+    def _fire(self, slot, at):
+        fired_at = datetime.fromtimestamp(at, timezone.utc).replace(tzinfo=None)
+        with app.app_context():
+            # the conditional update lets one process, once, claim each dose
+            claimed = db.session.execute(
+                Config.__table__.update()
+                .where(
+                    Config.id == slot.id,
+                    Config.active.is_(True),
+                    or_(Config.last_fired.is_(None), Config.last_fired < fired_at),
+                )
+                .values(last_fired=fired_at)
+            ).rowcount
+            db.session.commit()
+            device = device_serials.get(slot.device_id) if claimed else None
+        if not device:
+            self.skipped += 1
+            return
+        serie_number = device[0]
+        command = {"command": self.command, "slot": slot.slot, "config_id": slot.id}
+        command["hash"] = pending_commands.register(self.command, serie_number)
+        mqtt_client.publish(
+            f"{COMMAND_TOPIC}{serie_number}", payload_codec.encode(serie_number, command)
+        )
+        self.fired += 1
+
+
+dose_scheduler = DoseScheduler(
+    app.config["DOSE_COMMAND"],
+    ZoneInfo(app.config["DOSE_TIMEZONE"]) if app.config["DOSE_TIMEZONE"] else timezone.utc,
+    app.config["DOSE_GRACE_SECONDS"],
+)
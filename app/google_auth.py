@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+from urllib.request import urlopen
+
+import jwt
+
+from app import db_configs
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+
+class JWKSCache:
+    def __init__(self, url, key_file=None, cache_path=None, min_refresh_interval=60):
+        self.url = url
+        self.key_file = key_file
+        self.cache_path = cache_path
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = None
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def get(self, kid):
+        if self._keys is None:
+            with self._lock:
+                if self._keys is None:
+                    self._keys = self._parse(self._read_disk())
+        key = self._keys.get(kid)
+        if key is None and self.refresh():
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._last_refresh is not None
+                and now - self._last_refresh < self.min_refresh_interval
+            ):
+                return False
+            self._last_refresh = now
+            try:
+                data = self._fetch()
+            except Exception as e:
+                print("JWKS refresh failed", e)
+                return False
+            self._keys = self._parse(data)
+            return True
+
+    def _fetch(self):
+        if self.key_file:
+            with open(self.key_file) as file:
+                return json.load(file)
+        with urlopen(self.url, timeout=5) as response:
+            data = json.load(response)
+        if self.cache_path:
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.cache_path)
+        return data
+
+    def _read_disk(self):
+        for path in (self.key_file, self.cache_path):
+            if path and os.path.exists(path):
+                try:
+                    with open(path) as file:
+                        return json.load(file)
+                except (OSError, ValueError):
+                    continue
+        return {"keys": []}
+
+    @staticmethod
+    def _parse(data):
+        keys = {}
+        for key in data.get("keys", []):
+            try:
+                keys[key["kid"]] = jwt.PyJWK(key, key.get("alg") or "RS256")
+            except (KeyError, jwt.PyJWKError):
+                continue
+        return keys
+
+
+def verify_google_token(token):
+    kid = jwt.get_unverified_header(token).get("kid")
+    key = google_jwks.get(kid)
+    if key is None:
+        raise jwt.InvalidTokenError("Unknown signing key")
+    infos = jwt.decode(
+        token,
+        key.key,
+        algorithms=["RS256"],
+        audience=db_configs.google_client_id,
+        options={"require": ["exp", "aud", "iss"]},
+    )
+    if infos.get("iss") not in GOOGLE_ISSUERS:
+        raise jwt.InvalidIssuerError("Invalid issuer")
+    return infos
+
+
+google_jwks = JWKSCache(
+    db_configs.google_jwks_url,
+    db_configs.google_jwks_file,
+    db_configs.google_jwks_cache,
+)
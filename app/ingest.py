@@ -0,0 +1,115 @@
+import threading
+import time
+import zlib
+from collections import deque
+
+from app import app
+
+OVERFLOW_POLICIES = ("drop-oldest", "drop-newest", "block")
+
+
+class IngestShard:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+
+class IngestQueue:
+    def __init__(self, maxsize, workers, policy):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown ingest overflow policy {policy}")
+        self.policy = policy
+        # one worker per shard, keyed by topic, keeps each device's messages in order
+        self._shards = [IngestShard(max(maxsize // workers, 1)) for _ in range(workers)]
+        self._threads = []
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        for index, shard in enumerate(self._shards):
+            thread = threading.Thread(
+                target=self._run, args=(shard,), name=f"ingest-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, handler, topic, payload, policy=None):
+        policy = policy or self.policy
+        shard = self._shards[zlib.crc32(topic.encode()) % len(self._shards)]
+        item = (handler, topic, payload, time.time(), policy)
+        with shard.lock:
+            if len(shard.items) >= shard.maxsize:
+                if policy == "drop-oldest":
+                    # messages put with "block" are never shed, not even as the oldest
+                    oldest = next(
+                        (
+                            index
+                            for index, queued in enumerate(shard.items)
+                            if queued[4] != "block"
+                        ),
+                        None,
+                    )
+                    if oldest is None:
+                        policy = "drop-newest"
+                if policy == "drop-newest":
+                    self.dropped += 1
+                    return False
+                if policy == "drop-oldest":
+                    del shard.items[oldest]
+                    self.dropped += 1
+                else:
+                    shard.not_full.wait_for(lambda: len(shard.items) < shard.maxsize)
+            shard.items.append(item)
+            self.enqueued += 1
+            shard.not_empty.notify()
+        return True
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "depth": sum(len(shard.items) for shard in self._shards),
+            "capacity": sum(shard.maxsize for shard in self._shards),
+            "workers": len(self._shards),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "lag_seconds": self.lag,
+            "max_lag_seconds": self.max_lag,
+        }
+
+    def _run(self, shard):
+        while True:
+            with shard.lock:
+                shard.not_empty.wait_for(lambda: shard.items)
+                handler, topic, payload, received_at, _ = shard.items.popleft()
+                shard.not_full.notify()
+            lag = time.time() - received_at
+            try:
+                # handlers may hit the catalog or the database; the context
+                # teardown hands their session back to the pool
+                with app.app_context():
+                    handler(topic, payload, received_at)
+            except Exception as e:
+                self.errors += 1
+                print("Error processing", topic, e)
+            self.processed += 1
+            self.lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+
+ingest_queue = IngestQueue(
+    app.config["INGEST_QUEUE_SIZE"],
+    app.config["INGEST_WORKERS"],
+    app.config["INGEST_OVERFLOW"],
+)
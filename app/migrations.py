@@ -0,0 +1,165 @@
+from sqlalchemy import text
+
+from app.database import db
+
+MIGRATIONS = [
+    (
+        "0001_foreign_key_indexes",
+        [
+            ("ix_device_device_type", "device", "device_type"),
+            ("ix_device_field_device_type", "device_field", "device_type"),
+            ("ix_device_action_device_type", "device_action", "device_type"),
+            ("ix_device_action_param_action", "device_action_param", "action"),
+            ("ix_config_device_id", "config", "device_id"),
+            ("ix_alarm_device_id", "alarm", "device_id"),
+            ("ix_users_devices_device_id", "users_devices", "device_id"),
+        ],
+    ),
+    (
+        "0002_alarm_thresholds",
+        [
+            "ALTER TABLE alarm ADD COLUMN IF NOT EXISTS field VARCHAR(50)",
+            "ALTER TABLE alarm ADD COLUMN IF NOT EXISTS min_value FLOAT",
+            "ALTER TABLE alarm ADD COLUMN IF NOT EXISTS max_value FLOAT",
+            "ALTER TABLE alarm ADD COLUMN IF NOT EXISTS active BOOLEAN",
+        ],
+    ),
+    (
+        "0003_config_last_fired",
+        ["ALTER TABLE config ADD COLUMN IF NOT EXISTS last_fired TIMESTAMP"],
+    ),
+    (
+        "0004_alarm_breach_state",
+        ["ALTER TABLE alarm ADD COLUMN IF NOT EXISTS breached_at TIMESTAMP"],
+    ),
+    (
+        "0005_alarm_active_default",
+        [
+            "ALTER TABLE alarm ALTER COLUMN active SET DEFAULT true",
+            "UPDATE alarm SET active = true WHERE active IS NULL",
+        ],
+    ),
+    (
+        "0006_telemetry",
+        [
+            "CREATE TABLE IF NOT EXISTS telemetry ("
+            "id BIGSERIAL PRIMARY KEY, "
+            "serie_number VARCHAR(50) NOT NULL, "
+            "field VARCHAR(50) NOT NULL, "
+            "timestamp TIMESTAMP NOT NULL, "
+            "value FLOAT)",
+            (
+                "ix_telemetry_serie_number_field_timestamp",
+                "telemetry",
+                "serie_number",
+                "field",
+                "timestamp",
+            ),
+        ],
+    ),
+    (
+        "0007_device_field_reported_unit",
+        [
+            "ALTER TABLE device_field ADD COLUMN IF NOT EXISTS reported_unit VARCHAR(20)",
+            # values were already converted on ingest, so the declared unit was never theirs
+            "UPDATE device_field SET reported_unit = unit, unit = CASE lower(trim(unit)) "
+            "WHEN 'f' THEN 'C' WHEN '°f' THEN 'C' WHEN 'k' THEN 'C' "
+            "WHEN 'mmol/l' THEN 'mg/dL' WHEN 'kpa' THEN 'mmHg' "
+            "WHEN 'lb' THEN 'kg' WHEN 'lbs' THEN 'kg' END "
+            "WHERE reported_unit IS NULL "
+            "AND lower(trim(unit)) IN ('f', '°f', 'k', 'mmol/l', 'kpa', 'lb', 'lbs')",
+        ],
+    ),
+]
+
+EXPLAIN_QUERIES = {
+    "catalog actions": "SELECT * FROM device_action WHERE device_type = 1",
+    "catalog params": "SELECT * FROM device_action_param WHERE action = 1",
+    "catalog fields": "SELECT * FROM device_field WHERE device_type = 1",
+    "command device": "SELECT serie_number FROM device WHERE id = 1",
+    "devices by type": "SELECT id FROM device WHERE device_type = 1",
+    "user devices": "SELECT device_id FROM users_devices WHERE user_id = 1",
+    "device users": "SELECT user_id FROM users_devices WHERE device_id = 1",
+    "device configs": "SELECT * FROM config WHERE device_id = 1",
+    "device alarms": "SELECT * FROM alarm WHERE device_id = 1",
+    "telemetry series": "SELECT timestamp, value FROM telemetry "
+    "WHERE serie_number = 'x' AND field = 'y' AND timestamp >= now() - interval '1 day'",
+}
+
+
+def run_migrations(engine=None):
+    engine = engine or db.engine
+    # CREATE INDEX CONCURRENTLY refuses to run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations "
+                "(id VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+            )
+        )
+        applied = {
+            row[0] for row in connection.execute(text("SELECT id FROM schema_migrations"))
+        }
+        for migration_id, steps in MIGRATIONS:
+            if migration_id in applied:
+                continue
+            print("Applying", migration_id)
+            for step in steps:
+                if isinstance(step, str):
+                    connection.execute(text(step))
+                else:
+                    _create_index(connection, *step)
+            connection.execute(
+                text("INSERT INTO schema_migrations (id) VALUES (:id)"),
+                {"id": migration_id},
+            )
+
+
+def _create_index(connection, name, table, *columns):
+    # a failed concurrent build leaves an INVALID index that IF NOT EXISTS would skip
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    columns = ", ".join(f'"{column}"' for column in columns)
+    connection.execute(
+        text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({columns})')
+    )
+
+
+def missing_foreign_key_indexes(metadata=None):
+    metadata = metadata or db.metadata
+    missing = []
+    for table in metadata.sorted_tables:
+        prefixes = [tuple(column.name for column in table.primary_key.columns)]
+        prefixes += [tuple(column.name for column in index.columns) for index in table.indexes]
+        for constraint in table.foreign_key_constraints:
+            columns = tuple(column.name for column in constraint.columns)
+            if not any(prefix[: len(columns)] == columns for prefix in prefixes):
+                missing.append(f"{table.name}({', '.join(columns)})")
+    return missing
+
+
+def check_foreign_key_indexes(metadata=None):
+    missing = missing_foreign_key_indexes(metadata)
+    if missing:
+        raise RuntimeError("Foreign keys without an index: " + ", ".join(missing))
+
+
+def explain_index_usage(engine=None):
+    engine = engine or db.engine
+    results = {}
+    with engine.begin() as connection:
+        # planner would rather seq scan tiny tables, so only ask whether an index is usable
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, query in EXPLAIN_QUERIES.items():
+            plan = "\n".join(
+                row[0] for row in connection.execute(text("EXPLAIN " + query))
+            )
+            results[name] = "Index" in plan
+    return results
@@ -0,0 +1,52 @@
+from flask import Response, abort, request, stream_with_context
+
+from app.serializers import dumps
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+CHUNK_SIZE = 200
+
+
+def page_args():
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_LIMIT)
+        after = int(request.args["after"]) if request.args.get("after") else None
+    except ValueError:
+        abort(400, "Invalid pagination arguments")
+    if limit < 1:
+        abort(400, "Invalid pagination arguments")
+    return min(limit, MAX_LIMIT), after
+
+
+def int_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, f"Invalid {name}")
+
+
+def keyset(query, column, limit, after):
+    if after is not None:
+        query = query.filter(column > after)
+    return query.order_by(column).limit(limit)
+
+
+def stream_page(items, limit, serialize, cursor=None):
+    cursor = cursor or (lambda item: item.id)
+
+    def generate():
+        yield b"["
+        for start in range(0, len(items), CHUNK_SIZE):
+            chunk = b",".join(
+                dumps(serialize(item)) for item in items[start : start + CHUNK_SIZE]
+            )
+            yield chunk if start == 0 else b"," + chunk
+        yield b"]"
+
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = str(cursor(items[-1]))
+    return response
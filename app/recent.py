@@ -0,0 +1,149 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from app import app
+from app.cluster import cluster_bus
+
+
+class RecentRing:
+    __slots__ = ("times", "values", "head", "count")
+
+    def __init__(self, size):
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+    def items(self, limit=None):
+        size = len(self.values)
+        count = self.count if limit is None else min(limit, self.count)
+        start = self.head - count
+        return [
+            [self.times[i % size], self.values[i % size]]
+            for i in range(start, self.head)
+        ]
+
+    @property
+    def nbytes(self):
+        return (
+            self.times.buffer_info()[1] * self.times.itemsize
+            + self.values.buffer_info()[1] * self.values.itemsize
+        )
+
+
+class RecentReadings:
+    def __init__(self, size, max_series, idle_seconds, share_interval):
+        self.size = size
+        self.max_series = max_series
+        self.idle_seconds = idle_seconds
+        self.share_interval = share_interval
+        self.evicted = 0
+        self._devices = OrderedDict()
+        self._series = 0
+        self._lock = threading.Lock()
+        self._outbox = []
+        self._outbox_lock = threading.Lock()
+        # each reading is ingested by one worker, every worker serves /recent
+        cluster_bus.register("recent_readings.add", self._add_many)
+        cluster_bus.register("recent_readings.forget", self._forget)
+
+    def add(self, serie_number, values, timestamp=None):
+        timestamp = timestamp or time.time()
+        self._add(serie_number, values, timestamp)
+        if cluster_bus.enabled:
+            with self._outbox_lock:
+                self._outbox.append((serie_number, values, timestamp))
+                if len(self._outbox) == 1:
+                    threading.Timer(self.share_interval, self._share).start()
+
+    def latest(self, serie_number, fields=None, limit=None):
+        with self._lock:
+            entry = self._devices.get(serie_number)
+            if entry is None:
+                return {}
+            return {
+                # readings shared by other workers may arrive slightly out of order
+                field: sorted(ring.items(limit))
+                for field, ring in entry[1].items()
+                if not fields or field in fields
+            }
+
+    def forget(self, serie_number):
+        cluster_bus.publish("recent_readings.forget", serie_number)
+
+    def footprint(self):
+        with self._lock:
+            return {
+                "devices": len(self._devices),
+                "series": self._series,
+                "bytes": sum(
+                    ring.nbytes
+                    for _, rings in self._devices.values()
+                    for ring in rings.values()
+                ),
+                "evicted": self.evicted,
+            }
+
+    def _forget(self, serie_number):
+        with self._lock:
+            entry = self._devices.pop(serie_number, None)
+            if entry is not None:
+                self._series -= len(entry[1])
+
+    def _share(self):
+        with self._outbox_lock:
+            readings, self._outbox = self._outbox, []
+        if readings:
+            cluster_bus.share("recent_readings.add", readings)
+
+    def _add_many(self, readings):
+        for serie_number, values, timestamp in readings:
+            self._add(serie_number, values, timestamp)
+
+    def _add(self, serie_number, values, timestamp):
+        with self._lock:
+            entry = self._devices.get(serie_number)
+            if entry is None:
+                entry = self._devices[serie_number] = [timestamp, {}]
+            else:
+                entry[0] = timestamp
+                self._devices.move_to_end(serie_number)
+            rings = entry[1]
+            for field, value in values.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                ring = rings.get(field)
+                if ring is None:
+                    ring = rings[field] = RecentRing(self.size)
+                    self._series += 1
+                ring.append(timestamp, value)
+            self._evict(timestamp)
+
+    def _evict(self, now):
+        # devices are kept in last-update order, so idle ones sit at the front
+        while self._devices:
+            serie_number, entry = next(iter(self._devices.items()))
+            if self._series <= self.max_series and now - entry[0] < self.idle_seconds:
+                break
+            self._devices.popitem(last=False)
+            self._series -= len(entry[1])
+            self.evicted += 1
+
+
+recent_readings = RecentReadings(
+    app.config["RECENT_SIZE"],
+    app.config["RECENT_MAX_SERIES"],
+    app.config["RECENT_IDLE_SECONDS"],
+    app.config["RECENT_SHARE_INTERVAL"],
+)
@@ -0,0 +1,109 @@
+import threading
+
+from app import socketio
+from app.cluster import cluster_bus
+
+
+def device_room(serie_number):
+    return f"device:{serie_number}"
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+class RoomIndex:
+    def __init__(self):
+        self._device_users = {}
+        self._user_devices = {}
+        self._user_sids = {}
+        self._sid_user = {}
+        self._lock = threading.Lock()
+        # membership changes must reach the sockets held by every worker
+        cluster_bus.register("rooms.link", self._link)
+        cluster_bus.register("rooms.unlink", self._unlink)
+        cluster_bus.register("rooms.unlink_device", self._unlink_device)
+        cluster_bus.register("rooms.rename_device", self._rename_device)
+
+    def link(self, user_id, serie_number):
+        cluster_bus.publish("rooms.link", user_id, serie_number)
+
+    def unlink(self, user_id, serie_number):
+        cluster_bus.publish("rooms.unlink", user_id, serie_number)
+
+    def unlink_device(self, serie_number):
+        cluster_bus.publish("rooms.unlink_device", serie_number)
+
+    def rename_device(self, old_serie_number, new_serie_number):
+        cluster_bus.publish("rooms.rename_device", old_serie_number, new_serie_number)
+
+    def connect(self, sid, user_id, serie_numbers):
+        with self._lock:
+            self._sid_user[sid] = user_id
+            self._user_sids.setdefault(user_id, set()).add(sid)
+            devices = self._user_devices.setdefault(user_id, set())
+            for serie_number in serie_numbers:
+                devices.add(serie_number)
+                self._device_users.setdefault(serie_number, set()).add(user_id)
+            rooms = [user_room(user_id)] + [device_room(s) for s in devices]
+        for room in rooms:
+            socketio.server.enter_room(sid, room, namespace="/")
+
+    def disconnect(self, sid):
+        with self._lock:
+            user_id = self._sid_user.pop(sid, None)
+            sids = self._user_sids.get(user_id)
+            if sids is None:
+                return
+            sids.discard(sid)
+            if not sids:
+                del self._user_sids[user_id]
+                for serie_number in self._user_devices.pop(user_id, ()):
+                    self._discard(serie_number, user_id)
+
+    def _link(self, user_id, serie_number):
+        with self._lock:
+            sids = list(self._user_sids.get(user_id, ()))
+            if not sids:
+                return
+            self._user_devices[user_id].add(serie_number)
+            self._device_users.setdefault(serie_number, set()).add(user_id)
+        for sid in sids:
+            socketio.server.enter_room(sid, device_room(serie_number), namespace="/")
+
+    def _unlink(self, user_id, serie_number):
+        with self._lock:
+            sids = list(self._user_sids.get(user_id, ()))
+            if not sids:
+                return
+            self._user_devices[user_id].discard(serie_number)
+            self._discard(serie_number, user_id)
+        for sid in sids:
+            socketio.server.leave_room(sid, device_room(serie_number), namespace="/")
+
+    def _unlink_device(self, serie_number):
+        with self._lock:
+            user_ids = list(self._device_users.get(serie_number, ()))
+        for user_id in user_ids:
+            self._unlink(user_id, serie_number)
+
+    def _rename_device(self, old_serie_number, new_serie_number):
+        with self._lock:
+            user_ids = list(self._device_users.get(old_serie_number, ()))
+        for user_id in user_ids:
+            self._unlink(user_id, old_serie_number)
+            self._link(user_id, new_serie_number)
+
+    def users_of(self, serie_number):
+        with self._lock:
+            return set(self._device_users.get(serie_number, ()))
+
+    def _discard(self, serie_number, user_id):
+        users = self._device_users.get(serie_number)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._device_users[serie_number]
+
+
+room_index = RoomIndex()
@@ -0,0 +1,102 @@
+from app.cache import PARAM_COERCERS, catalog_cache
+
+# reported unit -> (canonical unit, conversion)
+UNIT_CONVERSIONS = {
+    "f": ("C", lambda value: (value - 32) * 5 / 9),
+    "°f": ("C", lambda value: (value - 32) * 5 / 9),
+    "k": ("C", lambda value: value - 273.15),
+    "mmol/l": ("mg/dL", lambda value: value * 18.0),
+    "kpa": ("mmHg", lambda value: value * 7.50062),
+    "lb": ("kg", lambda value: value * 0.45359237),
+    "lbs": ("kg", lambda value: value * 0.45359237),
+}
+
+
+def _to_int(value):
+    # command params may round, but a fractional reading is the wrong type
+    if isinstance(value, bool):
+        raise TypeError(f"{value!r} is not an integer")
+    if isinstance(value, int):
+        return value
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"{value!r} is not an integer")
+    return int(number)
+
+
+TELEMETRY_COERCERS = dict(PARAM_COERCERS, int=_to_int, integer=_to_int)
+
+
+def normalize_unit(unit):
+    # declared units with a conversion are stored canonical, the original is kept as reported
+    convert = UNIT_CONVERSIONS.get((unit or "").strip().lower())
+    if convert is None:
+        return unit, None
+    return convert[0], unit
+
+
+class TelemetrySchema:
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = {}
+        for field in fields:
+            coerce = TELEMETRY_COERCERS.get((field["field_type"] or "").lower())
+            convert = UNIT_CONVERSIONS.get((field["reported_unit"] or "").strip().lower())
+            self.fields[field["name"]] = (coerce, convert[1] if convert else None)
+
+    def apply(self, values):
+        accepted = {}
+        rejected = 0
+        for name, value in values.items():
+            rule = self.fields.get(name)
+            if rule is None or value is None:
+                rejected += 1
+                continue
+            coerce, convert = rule
+            try:
+                if coerce is not None:
+                    value = coerce(value)
+                if convert is not None:
+                    value = convert(value)
+            except (TypeError, ValueError):
+                rejected += 1
+                continue
+            accepted[name] = value
+        return accepted, rejected
+
+
+class TelemetrySchemas:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.accepted = 0
+        self.rejected = 0
+        self._version = None
+        self._schemas = {}
+
+    def apply(self, device_type, values):
+        if self._version != self.catalog.version:
+            self._compile()
+        schema = self._schemas.get(device_type)
+        # types without declared fields keep accepting whatever they send
+        if schema is None:
+            return values
+        values, rejected = schema.apply(values)
+        self.accepted += len(values)
+        self.rejected += rejected
+        return values
+
+    def stats(self):
+        return {"accepted": self.accepted, "rejected": self.rejected}
+
+    def _compile(self):
+        version = self.catalog.version
+        self._schemas = {
+            device_type["id"]: TelemetrySchema(device_type["fields"])
+            for device_type in self.catalog.get().values()
+            if device_type["fields"]
+        }
+        self._version = version
+
+
+telemetry_schemas = TelemetrySchemas(catalog_cache)
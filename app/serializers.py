@@ -0,0 +1,106 @@
+from datetime import date, datetime
+from operator import attrgetter
+
+from flask import Response, json
+from werkzeug.http import http_date
+
+from app.database import (Alarm, Config, Device, DeviceAction,
+                          DeviceActionParam, DeviceField, DeviceType, User)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Serializer:
+    def __init__(self, model, *names):
+        self.names = names
+        self.columns = tuple(getattr(model, name) for name in names)
+        getter = attrgetter(*names)
+        if len(names) == 1:
+            self._values = lambda obj: (getter(obj),)
+        else:
+            self._values = getter
+
+    def __call__(self, obj):
+        return dict(zip(self.names, self._values(obj)))
+
+    def row(self, row):
+        return dict(zip(self.names, row))
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+
+    def dumps(value):
+        return orjson.dumps(
+            value, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+else:
+
+    def dumps(value):
+        return json.dumps(value).encode("utf-8")
+
+
+def json_response(value, status=200):
+    return Response(dumps(value), status=status, mimetype="application/json")
+
+
+device_serializer = Serializer(
+    Device, "id", "serie_number", "alias_name", "firmware_version", "device_type"
+)
+user_device_serializer = Serializer(
+    Device, "id", "serie_number", "alias_name", "firmware_version"
+)
+user_serializer = Serializer(User, "id", "name", "email", "picture")
+config_serializer = Serializer(
+    Config,
+    "id",
+    "hour",
+    "minute",
+    "start_time",
+    "end_time",
+    "active",
+    "slot",
+    "last_fired",
+    "device_id",
+)
+alarm_serializer = Serializer(
+    Alarm,
+    "id",
+    "minutes",
+    "hours",
+    "repeatitions",
+    "repeatitions_interval",
+    "light",
+    "light_duration",
+    "sound",
+    "sound_duration",
+    "inform_to_user",
+    "field",
+    "min_value",
+    "max_value",
+    "active",
+    "device_id",
+)
+device_type_serializer = Serializer(DeviceType, "id", "name")
+device_action_serializer = Serializer(
+    DeviceAction, "id", "name", "function", "device_type"
+)
+device_action_param_serializer = Serializer(
+    DeviceActionParam, "id", "name", "param_type", "action"
+)
+device_field_serializer = Serializer(
+    DeviceField, "id", "name", "unit", "reported_unit", "field_type", "device_type"
+)
+catalog_action_serializer = Serializer(DeviceAction, "id", "name", "function")
+catalog_field_serializer = Serializer(
+    DeviceField, "id", "name", "unit", "reported_unit", "field_type"
+)
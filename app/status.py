@@ -0,0 +1,33 @@
+from flask_jwt_extended import jwt_required
+from flask_restx import Namespace, Resource
+
+from app.alarm_rules import alarm_engine
+from app.cache import serial_resolver
+from app.commands import pending_commands
+from app.dose import dose_scheduler
+from app.ingest import ingest_queue
+from app.recent import recent_readings
+from app.schema import telemetry_schemas
+from app.serializers import json_response
+from app.telemetry import telemetry_buffer
+
+api = Namespace("status", description="Runtime counters")
+
+
+@api.route("/", methods=["GET"])
+class StatusView(Resource):
+    @api.doc(security="Bearer")
+    @jwt_required()
+    def get(self):
+        return json_response(
+            {
+                "ingest": ingest_queue.stats(),
+                "resolver": serial_resolver.stats(),
+                "telemetry": telemetry_buffer.stats(),
+                "schema": telemetry_schemas.stats(),
+                "recent": recent_readings.footprint(),
+                "commands": pending_commands.stats(),
+                "alarms": alarm_engine.stats(),
+                "doses": dose_scheduler.stats(),
+            }
+        )
@@ -0,0 +1,122 @@
+import atexit
+import threading
+from datetime import datetime
+
+from app import app
+from app.database import Telemetry, db
+
+
+class TelemetryBuffer:
+    def __init__(self, batch_size, flush_interval, max_rows, block_timeout):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.block_timeout = block_timeout
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._rows = []
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="telemetry-flush", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(self.flush_interval + 5)
+        self.flush()
+
+    def add(self, serie_number, values, timestamp=None):
+        timestamp = timestamp or datetime.utcnow()
+        rows = []
+        for field, value in values.items():
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                self.rejected += 1
+                continue
+            rows.append(
+                {
+                    "serie_number": serie_number,
+                    "field": field,
+                    "timestamp": timestamp,
+                    "value": value,
+                }
+            )
+        if not rows:
+            return 0
+
+        with self._not_full:
+            if len(self._rows) + len(rows) > self.max_rows:
+                self._wakeup.set()
+                self._not_full.wait_for(
+                    lambda: len(self._rows) + len(rows) <= self.max_rows,
+                    self.block_timeout,
+                )
+            if len(self._rows) + len(rows) > self.max_rows:
+                self.dropped += len(rows)
+                return 0
+            self._rows.extend(rows)
+            self.buffered += len(rows)
+            if len(self._rows) >= self.batch_size:
+                self._wakeup.set()
+        return len(rows)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._not_full:
+                rows, self._rows = self._rows, []
+                self._not_full.notify_all()
+            if not rows:
+                return 0
+            try:
+                # psycopg2 executemany is turned into multi-row VALUES pages
+                with db.engine.begin() as connection:
+                    connection.execute(Telemetry.__table__.insert(), rows)
+            except Exception as e:
+                print("Telemetry flush failed", e)
+                with self._not_full:
+                    room = max(self.max_rows - len(self._rows), 0)
+                    self._rows[:0] = rows[:room]
+                    self.dropped += len(rows) - min(room, len(rows))
+                return 0
+            with self._lock:
+                self.flushed += len(rows)
+            return len(rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": self.buffered,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "pending": len(self._rows),
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+telemetry_buffer = TelemetryBuffer(
+    app.config["TELEMETRY_BATCH_SIZE"],
+    app.config["TELEMETRY_FLUSH_INTERVAL"],
+    app.config["TELEMETRY_MAX_BUFFER"],
+    app.config["TELEMETRY_BLOCK_TIMEOUT"],
+)
@@ -1,9 +1,15 @@
 # pyright: reportOptionalSubscript=false
-from flask import abort, jsonify, request
+from flask import abort, request
 from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource, fields
 
-from app.database import User, db
+from app.cache import (device_serials, login_users, serial_resolver,
+                       table_versions)
+from app.database import Device, User, db, users_devices
+from app.pagination import int_arg, keyset, page_args, stream_page
+from app.rooms import room_index
+from app.serializers import (device_serializer, json_response,
+                             user_device_serializer, user_serializer)
 
 api = Namespace('user', description='User CRUD')
 
@@ -15,28 +21,43 @@ user_model = api.model('UserModel', {
 
 @api.route('/', methods=["GET", "POST"])
 class UserView(Resource):
-    @api.doc(security="Bearer")
+    @api.doc(security="Bearer", params={
+        'limit': 'Page size',
+        'after': 'Return users with id greater than this cursor',
+        'device_type': 'Only users owning a device of this type',
+        'serie_number': 'Only users owning a device with this serie number prefix'
+    })
     @jwt_required()
     def get(self):
-        users = User.query.paginate(1, 10).items
-        res = []
-        for user in users:
-            devices = []
-            for device in user.devices:
-                devices.append({
-                    'id': device.id,
-                    'serie_number': device.serie_number,
-                    'alias_name': device.alias_name,
-                    'firmware_version': device.firmware_version
-                })
-            res = {
-                'id': user.id,
-                'name': user.name,
-                'email': user.email,
-                'picture': user.picture,
-                'devices': devices
-            }
-        return jsonify(res)
+        limit, after = page_args()
+        query = db.session.query(*user_serializer.columns)
+        if request.args.get('device_type') or request.args.get('serie_number'):
+            owned = db.session.query(users_devices.c.user_id).join(
+                Device, Device.id == users_devices.c.device_id
+            )
+            if request.args.get('device_type'):
+                owned = owned.filter(Device.device_type == int_arg('device_type'))
+            if request.args.get('serie_number'):
+                owned = owned.filter(Device.serie_number.startswith(request.args['serie_number'], autoescape=True))
+            query = query.filter(User.id.in_(owned))
+        users = keyset(query, User.id, limit, after).all()
+
+        devices = {}
+        if users:
+            rows = db.session.query(
+                users_devices.c.user_id, *user_device_serializer.columns
+            ).join(Device, Device.id == users_devices.c.device_id).filter(
+                users_devices.c.user_id.in_([user.id for user in users])
+            ).order_by(Device.id)
+            for row in rows:
+                devices.setdefault(row[0], []).append(user_device_serializer.row(row[1:]))
+
+        def serialize(user):
+            res = user_serializer.row(user)
+            res['devices'] = devices.get(user.id, [])
+            return res
+
+        return stream_page(users, limit, serialize)
 
     @api.expect(user_model)
     @api.doc(security="Bearer")
@@ -48,12 +69,7 @@ class UserView(Resource):
                 setattr(user, param, request.json[param])
         db.session.add(user)
         db.session.commit()
-        return jsonify({
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'picture': user.picture
-        })
+        return json_response(user_serializer(user))
 
 
 @api.route('/<int:id>', methods=["GET", "PATCH", "DELETE"])
@@ -61,25 +77,12 @@ class UserIdView(Resource):
     @api.doc(security="Bearer")
     @jwt_required()
     def get(self, id):
-        user = User.query.filter_by(id=id).first()
+        user = db.session.query(*user_serializer.columns).filter(User.id == id).first()
         if not user:
             abort(404)
-        devices = []
-        for device in user.devices:
-            devices.append({
-                'id': device.id,
-                'serie_number': device.serie_number,
-                'alias_name': device.alias_name,
-                'firmware_version': device.firmware_version
-            })
-        res = {
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'picture': user.picture,
-            'devices': devices
-        }
-        return jsonify(res)
+        res = user_serializer.row(user)
+        res['devices'] = UserUtils.devices(id)
+        return json_response(res)
 
     @api.expect(user_model)
     @api.doc(security="Bearer")
@@ -91,32 +94,64 @@ class UserIdView(Resource):
                 setattr(user, param, request.json[param])
         db.session.add(user)
         db.session.commit()
-        devices = []
-        for device in user.devices:
-            devices.append({
-                'id': device.id,
-                'serie_number': device.serie_number,
-                'alias_name': device.alias_name,
-                'firmware_version': device.firmware_version
-            })
-        return jsonify({
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'picture': user.picture,
-            'devices': devices
-        })
+        login_users.invalidate()
+        res = user_serializer(user)
+        res['devices'] = UserUtils.devices(id)
+        return json_response(res)
 
     @api.doc(security="Bearer")
     @jwt_required()
     def delete(self, id):
-        user = db.session.query(User).filter(User.id==id).first()
-        db.session.delete(user)
+        if not db.session.query(User.id).filter(User.id == id).first():
+            abort(404)
+        # same effect as the User.devices delete cascade, without loading the devices
+        devices = db.session.query(Device.id, Device.serie_number).join(
+            users_devices, users_devices.c.device_id == Device.id
+        ).filter(users_devices.c.user_id == id).all()
+        device_ids = [device.id for device in devices]
+        if device_ids:
+            db.session.execute(users_devices.delete().where(users_devices.c.device_id.in_(device_ids)))
+            db.session.execute(Device.__table__.delete().where(Device.id.in_(device_ids)))
+        db.session.execute(users_devices.delete().where(users_devices.c.user_id == id))
+        db.session.execute(User.__table__.delete().where(User.id == id))
         db.session.commit()
+        table_versions.bump("device", "users_devices")
+        login_users.invalidate()
+        if devices:
+            serial_resolver.forget(*[device.serie_number for device in devices])
+        for device_id, serie_number in devices:
+            device_serials.invalidate(device_id)
+            room_index.unlink_device(serie_number)
         return
     
     def user_by_email(self, email):
         try:
             return User.query.filter(User.email == email).first()
         except:
-            return None
\ No newline at end of file
+            return None
+
+
+@api.route('/<int:id>/devices', methods=["GET"])
+class UserDevicesView(Resource):
+    @api.doc(security="Bearer", params={
+        'limit': 'Page size',
+        'after': 'Return devices with id greater than this cursor'
+    })
+    @jwt_required()
+    def get(self, id):
+        limit, after = page_args()
+        # keyset on users_devices.device_id walks the (user_id, device_id) primary key
+        query = db.session.query(*device_serializer.columns).join(
+            users_devices, users_devices.c.device_id == Device.id
+        ).filter(users_devices.c.user_id == id)
+        devices = keyset(query, users_devices.c.device_id, limit, after).all()
+        return stream_page(devices, limit, device_serializer.row)
+
+
+class UserUtils():
+    @staticmethod
+    def devices(user_id):
+        rows = db.session.query(*user_device_serializer.columns).join(
+            users_devices, users_devices.c.device_id == Device.id
+        ).filter(users_devices.c.user_id == user_id).order_by(Device.id)
+        return [user_device_serializer.row(row) for row in rows]
\ No newline at end of file
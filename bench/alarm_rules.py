@@ -0,0 +1,66 @@
+"""Alarm rule evaluation with 100k rules loaded.
+
+    python -m bench.alarm_rules [readings] [rules] [devices]
+
+Rules are fabricated in memory and every reading stays inside its
+thresholds, so no breach touches the database. Needs the same SERVER_* and
+BROKER_* environment as the app.
+"""
+import sys
+
+from app.alarm_rules import alarm_engine
+from bench.common import measure, report
+
+FIELDS = ("temperature", "heart_rate")
+
+
+def rules(count, devices):
+    per_key = max(count // (devices * len(FIELDS)), 1)
+    for id in range(1, count + 1):
+        key = (id - 1) // per_key
+        device_id = key // len(FIELDS) % devices + 1
+        field = FIELDS[key % len(FIELDS)]
+        # id, device_id, field, min_value, max_value, repeatitions,
+        # repeatitions_interval, light, light_duration, sound, sound_duration,
+        # inform_to_user
+        yield (id, device_id, field, 0.0, 200.0 + id % 50, 3, 60, True, 5, True, 5, True)
+
+
+def scan(rows, device_id, values):
+    # one pass over every rule, as without the (device, field) index
+    breached = 0
+    for row in rows:
+        value = values.get(row[2]) if row[1] == device_id else None
+        if value is not None and (value < row[3] or value > row[4]):
+            breached += 1
+    return breached
+
+
+def main(readings=100000, count=100000, devices=10000):
+    rows = list(rules(count, devices))
+    alarm_engine._update(rows)
+    alarm_engine._loaded = True
+    values = {"temperature": 36.6, "heart_rate": 72}
+    per_reading = len(alarm_engine._index.get((1, FIELDS[0]), ())) * len(FIELDS)
+
+    def indexed(index):
+        alarm_engine.evaluate(index % devices + 1, "BENCH", values)
+
+    try:
+        scanned = max(readings // 1000, 10)
+        wall, cpu = measure(lambda index: scan(rows, index % devices + 1, values), scanned)
+        report("linear scan", scanned, wall, cpu, unit="reading",
+               rule_checks_per_s=f"{scanned * count / wall:,.0f}", rules=count)
+        evaluated = alarm_engine.evaluated
+        wall, cpu = measure(indexed, readings)
+        evaluated = alarm_engine.evaluated - evaluated
+        assert evaluated == readings * per_reading, evaluated
+        report("(device, field) index", readings, wall, cpu, unit="reading",
+               rule_checks_per_s=f"{evaluated / wall:,.0f}", rules=count)
+    finally:
+        alarm_engine._remove(*(row[0] for row in rows))
+        alarm_engine._loaded = False
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,24 @@
+import time
+
+
+def measure(fn, count):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for index in range(count):
+        fn(index)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def report(name, count, wall, cpu, unit="message", **extra):
+    line = (
+        f"{name:<36} {count / wall:>12,.0f} {unit}s/s"
+        f" {cpu / count * 1e6:>10.1f} us CPU/{unit}"
+    )
+    for key, value in extra.items():
+        line += f"  {key}={value}"
+    print(line)
@@ -0,0 +1,102 @@
+"""Listing 10k devices: ORM objects + jsonify against the serializer path.
+
+    python -m bench.device_list [devices] [rounds]
+
+Seeds devices with a BENCH- serie number prefix into the configured
+database and removes them afterwards.
+"""
+import sys
+import time
+
+from flask import json
+from flask_jwt_extended import create_access_token
+
+from app import app
+from app.database import Device, db
+from app.serializers import device_serializer, dumps
+from bench.common import report
+
+
+def seed(count):
+    with app.app_context():
+        db.session.execute(
+            Device.__table__.insert(),
+            [
+                {
+                    "serie_number": f"BENCH-{index:06d}",
+                    "alias_name": f"device {index}",
+                    "firmware_version": "1.0.0",
+                }
+                for index in range(count)
+            ],
+        )
+        db.session.commit()
+
+
+def cleanup():
+    with app.app_context():
+        Device.query.filter(Device.serie_number.startswith("BENCH-")).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+
+
+def orm_jsonify():
+    # the list view before the serializer layer
+    devices = (
+        Device.query.filter(Device.serie_number.startswith("BENCH-")).order_by(Device.id).all()
+    )
+    return json.dumps([device.columns() for device in devices])
+
+
+def serializer_rows():
+    rows = (
+        db.session.query(*device_serializer.columns)
+        .filter(Device.serie_number.startswith("BENCH-"))
+        .order_by(Device.id)
+        .all()
+    )
+    return dumps([device_serializer.row(row) for row in rows])
+
+
+def main(devices=10000, rounds=5):
+    cleanup()
+    seed(devices)
+    try:
+        for name, fn in (
+            ("ORM objects + json.dumps", orm_jsonify),
+            ("Core rows + serializer", serializer_rows),
+        ):
+            with app.app_context():
+                fn()
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                for _ in range(rounds):
+                    size = len(fn())
+                    db.session.expunge_all()
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                report(name, rounds, wall, cpu, unit="list", bytes=size)
+
+        with app.app_context():
+            headers = {"Authorization": f"Bearer {create_access_token('bench@example.com')}"}
+        client = app.test_client()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for _ in range(rounds):
+            after, pages = None, 0
+            while True:
+                url = "/device/?limit=1000" + (f"&after={after}" if after else "")
+                response = client.get(url, headers=headers)
+                response.get_data()
+                pages += 1
+                after = response.headers.get("X-Next-Cursor")
+                if not after:
+                    break
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        report("GET /device/ in 1000-row pages", rounds, wall, cpu, unit="list", pages=pages)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,64 @@
+"""Socket.IO emits for multi-field value messages.
+
+    python -m bench.emit_values [messages] [devices]
+
+Needs the same SERVER_* and BROKER_* environment as the app.
+"""
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+from app import socketio
+from app.coalescer import ValuesCoalescer, emit_values
+from app.rooms import device_room
+from bench.common import measure, report
+
+FIELDS = ("heart_rate", "spo2", "systolic", "diastolic", "temperature",
+          "glucose", "respiration", "weight", "steps", "battery")
+
+
+def main(messages=20000, devices=200):
+    payloads = [
+        (f"BENCH{index % devices:05d}", {field: index % 100 for field in FIELDS})
+        for index in range(messages)
+    ]
+
+    def per_field(index):
+        # the handler before coalescing: one emit and one print per key
+        serie_number, values = payloads[index]
+        for key, value in values.items():
+            print(serie_number, key, value)
+            socketio.emit(
+                "values",
+                {"msg": {"serie_number": serie_number, "key": key, "value": value}},
+                to=device_room(serie_number),
+            )
+
+    def per_message(index):
+        emit_values(*payloads[index])
+
+    with redirect_stdout(io.StringIO()):
+        wall, cpu = measure(per_field, messages)
+    report("per-field emit + print (before)", messages, wall, cpu, emits=messages * len(FIELDS))
+
+    wall, cpu = measure(per_message, messages)
+    report("one frame per message", messages, wall, cpu, emits=messages)
+
+    for window in (0.05, 0.2):
+        emitted = []
+        coalescer = ValuesCoalescer(
+            lambda serie_number, values: (emitted.append(1), emit_values(serie_number, values)),
+            window,
+        )
+        started = time.process_time()
+        wall, _ = measure(lambda index: coalescer.push(*payloads[index]), messages)
+        time.sleep(window * 2)
+        coalescer.flush()
+        # CPU includes the background flushes, wall time only the pushes
+        cpu = time.process_time() - started
+        report(f"coalesced {int(window * 1000)} ms window", messages, wall, cpu, emits=len(emitted))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,122 @@
+"""REST latency and concurrent Socket.IO capacity of a running server.
+
+    python -m bench.load [requests] [concurrency] [sockets]
+
+Targets LOAD_TEST_URL when set, otherwise starts gunicorn -c gunicorn.conf.py
+serve:app in the current SERVER_MODE on a free port and stops it afterwards.
+The socket clients need python-socketio[client]. Needs the same SERVER_* and
+BROKER_* environment as the app.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+from flask_jwt_extended import create_access_token
+
+from app import app
+from app.database import User, db
+from bench.common import percentile
+
+EMAIL = "bench-load@example.com"
+
+
+def start_server():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "serve:app"],
+        env={**os.environ, "HOST": "127.0.0.1", "PORT": str(port)},
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/swagger.json", timeout=1)
+            return server, url
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("server did not start")
+
+
+def rest(url, token, count, concurrency):
+    def get(_):
+        started = time.perf_counter()
+        request = urllib.request.Request(
+            f"{url}/device_type/", headers={"Authorization": f"Bearer {token}"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(get, range(count)))
+    wall = time.perf_counter() - started
+    print(
+        f"{'GET /device_type/':<36} {count / wall:>12,.0f} requests/s"
+        f"  p50={percentile(latencies, 0.5) * 1e3:.1f}ms"
+        f"  p99={percentile(latencies, 0.99) * 1e3:.1f}ms"
+        f"  concurrency={concurrency}"
+    )
+
+
+def sockets(url, token, count):
+    clients = []
+    latencies = []
+    failed = 0
+    for _ in range(count):
+        client = socketio.Client(reconnection=False)
+        started = time.perf_counter()
+        try:
+            client.connect(url, auth={"token": token}, wait_timeout=10)
+        except socketio.exceptions.ConnectionError:
+            failed += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        clients.append(client)
+    time.sleep(1)
+    alive = sum(client.connected for client in clients)
+    print(
+        f"{'Socket.IO connections':<36} {alive:>12,} held of {count}"
+        f"  failed={failed}"
+        f"  connect_p50={percentile(latencies or [0], 0.5) * 1e3:.1f}ms"
+        f"  connect_p99={percentile(latencies or [0], 0.99) * 1e3:.1f}ms"
+    )
+    for client in clients:
+        client.disconnect()
+
+
+def main(requests=2000, concurrency=50, sockets_count=200):
+    with app.app_context():
+        if not User.query.filter(User.email == EMAIL).first():
+            db.session.add(User(email=EMAIL, name=EMAIL, picture=""))
+            db.session.commit()
+        token = create_access_token(identity=EMAIL)
+    server = None
+    url = os.environ.get("LOAD_TEST_URL")
+    if not url:
+        server, url = start_server()
+    try:
+        print(f"target {url} SERVER_MODE={os.environ.get('SERVER_MODE') or 'eventlet'}")
+        rest(url, token, requests, concurrency)
+        sockets(url, token, sockets_count)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        with app.app_context():
+            User.query.filter(User.email == EMAIL).delete()
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,91 @@
+"""Login throughput: unverified decode + query against JWKS verify + cache.
+
+    python -m bench.logins [logins] [users]
+
+Runs offline: a throwaway RSA key is published through GOOGLE_JWKS_FILE.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+KID = "bench"
+CLIENT_ID = "bench-client"
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+jwk.update(kid=KID, alg="RS256", use="sig")
+key_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+json.dump({"keys": [jwk]}, key_file)
+key_file.close()
+os.environ["GOOGLE_JWKS_FILE"] = key_file.name
+os.environ["GOOGLE_CLIENT_ID"] = CLIENT_ID
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import app  # noqa: E402
+from app.cache import login_users  # noqa: E402
+from app.database import User, db  # noqa: E402
+from bench.common import report  # noqa: E402
+
+
+def google_token(email):
+    now = int(time.time())
+    return jwt.encode(
+        {"iss": "accounts.google.com", "aud": CLIENT_ID, "iat": now, "exp": now + 3600,
+         "email": email, "name": email, "picture": ""},
+        private_key,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+
+def before(token):
+    # the login handler before JWKS verification and the user cache
+    infos = jwt.decode(token, options={"verify_signature": False})
+    user = User.query.filter(User.email == infos["email"]).first()
+    return create_access_token(identity=user.email)
+
+
+def main(logins=2000, users=50):
+    emails = [f"bench-{index}@example.com" for index in range(users)]
+    tokens = [google_token(email) for email in emails]
+    client = app.test_client()
+    with app.app_context():
+        User.query.filter(User.email.startswith("bench-")).delete(synchronize_session=False)
+        db.session.add_all(User(email=email, name=email, picture="") for email in emails)
+        db.session.commit()
+    try:
+        with app.test_request_context():
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            for index in range(logins):
+                before(tokens[index % users])
+            report("decode unverified + query (before)", logins,
+                   time.perf_counter() - wall, time.process_time() - cpu, unit="login")
+
+        for name, cold in (("POST /auth/ verified, cold cache", True),
+                           ("POST /auth/ verified, cached", False)):
+            login_users.invalidate()
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            for index in range(logins):
+                if cold:
+                    login_users.invalidate()
+                response = client.post("/auth/", json={"token": tokens[index % users]})
+                assert response.status_code == 200, response.get_data()
+            report(name, logins, time.perf_counter() - wall, time.process_time() - cpu,
+                   unit="login")
+    finally:
+        with app.app_context():
+            User.query.filter(User.email.startswith("bench-")).delete(synchronize_session=False)
+            db.session.commit()
+        os.unlink(key_file.name)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,77 @@
+"""Bytes on the wire and decode time per values payload format.
+
+    python -m bench.payload_formats [messages]
+
+Needs the same SERVER_* and BROKER_* environment as the app.
+"""
+import struct
+import sys
+
+import cbor2
+import msgpack
+
+from app.codecs import (
+    CBOR,
+    JSON,
+    MSGPACK,
+    STRUCT,
+    STRUCT_MAGIC,
+    StructLayouts,
+    payload_codec,
+    sniff,
+)
+from app.serializers import dumps
+from bench.common import measure, report
+
+FIELDS = (
+    ("temperature", "float", 36.7),
+    ("humidity", "float", 48.2),
+    ("heart_rate", "int", 72),
+    ("spo2", "int", 98),
+    ("battery", "int", 87),
+    ("alarm", "bool", False),
+)
+
+
+class StaticCatalog:
+    version = 1
+
+    def get(self):
+        return {
+            1: {
+                "id": 1,
+                "fields": [{"name": name, "field_type": kind} for name, kind, _ in FIELDS],
+            }
+        }
+
+
+layouts = StructLayouts(StaticCatalog())
+
+
+def decode(payload):
+    # PayloadCodec.decode_values without the per-device format bookkeeping
+    view = memoryview(payload)
+    if sniff(view) == STRUCT:
+        names, packer = layouts.get(1)
+        return dict(zip(names, packer.unpack_from(view, 1)))
+    return payload_codec._decode(sniff(view), view)
+
+
+def main(messages=200000):
+    values = {name: value for name, _, value in FIELDS}
+    names, packer = layouts.get(1)
+    payloads = {
+        JSON: dumps(values),
+        MSGPACK: msgpack.packb(values),
+        CBOR: cbor2.dumps(values),
+        STRUCT: struct.pack("<B", STRUCT_MAGIC) + packer.pack(*(values[name] for name in names)),
+    }
+    for format, payload in payloads.items():
+        decoded = decode(payload)
+        assert decoded.keys() == values.keys(), (format, decoded)
+        wall, cpu = measure(lambda _: decode(payload), messages)
+        report(format, messages, wall, cpu, bytes=len(payload))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
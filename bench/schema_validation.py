@@ -0,0 +1,95 @@
+"""Telemetry validation: compiled schemas against per-message field lookups.
+
+    python -m bench.schema_validation [messages]
+
+Seeds a BENCH- device type with fields into the configured database and
+removes it afterwards.
+"""
+import sys
+
+from app import app
+from app.cache import CATALOG_TABLES, table_versions
+from app.database import DeviceField, DeviceType, db
+from app.schema import (
+    TELEMETRY_COERCERS,
+    UNIT_CONVERSIONS,
+    normalize_unit,
+    telemetry_schemas,
+)
+from bench.common import measure, report
+
+FIELDS = (
+    ("temperature", "float", "F"),
+    ("humidity", "float", "%"),
+    ("heart_rate", "int", "bpm"),
+    ("spo2", "int", "%"),
+    ("glucose", "float", "mmol/L"),
+    ("battery", "int", "%"),
+)
+VALUES = {
+    "temperature": "98.1",
+    "humidity": 48.2,
+    "heart_rate": 72,
+    "spo2": "98",
+    "glucose": 5.4,
+    "battery": 87,
+    "unknown": 1,
+}
+
+
+def lookup(device_type, values):
+    # validation as a handler without the compiled schemas would do it
+    fields = {
+        field.name: field
+        for field in DeviceField.query.filter(DeviceField.device_type == device_type)
+    }
+    accepted = {}
+    for name, value in values.items():
+        field = fields.get(name)
+        if field is None:
+            continue
+        try:
+            value = TELEMETRY_COERCERS[field.field_type.lower()](value)
+            convert = UNIT_CONVERSIONS.get((field.reported_unit or "").strip().lower())
+            accepted[name] = convert[1](value) if convert else value
+        except (KeyError, TypeError, ValueError):
+            continue
+    return accepted
+
+
+def main(messages=5000):
+    with app.app_context():
+        device_type = DeviceType(name="BENCH-schema")
+        db.session.add(device_type)
+        db.session.flush()
+        db.session.add_all(
+            DeviceField(
+                name=name,
+                field_type=kind,
+                unit=normalize_unit(unit)[0],
+                reported_unit=normalize_unit(unit)[1],
+                device_type=device_type.id,
+            )
+            for name, kind, unit in FIELDS
+        )
+        db.session.commit()
+        table_versions.bump(*CATALOG_TABLES)
+        id = device_type.id
+        try:
+            assert lookup(id, VALUES) == telemetry_schemas.apply(id, VALUES)
+            for name, fn in (
+                ("per-message field query", lambda _: lookup(id, VALUES)),
+                ("compiled schema", lambda _: telemetry_schemas.apply(id, VALUES)),
+            ):
+                wall, cpu = measure(fn, messages)
+                report(name, messages, wall, cpu)
+        finally:
+            db.session.rollback()
+            DeviceField.query.filter(DeviceField.device_type == id).delete()
+            DeviceType.query.filter(DeviceType.id == id).delete()
+            db.session.commit()
+            table_versions.bump(*CATALOG_TABLES)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,32 @@
+from os import environ
+
+SERVER_MODE = environ.get("SERVER_MODE") or "eventlet"
+
+bind = f"{environ.get('HOST') or '0.0.0.0'}:{environ.get('PORT') or 5000}"
+
+# Socket.IO needs sticky sessions and a message queue (CLUSTER_MODE) beyond one worker
+workers = int(environ.get("WEB_WORKERS") or 1)
+worker_class = {
+    "eventlet": "eventlet",
+    "gevent": "geventwebsocket.gunicorn.workers.GeventWebSocketWorker",
+    "threading": "gthread",
+}[SERVER_MODE]
+worker_connections = int(environ.get("WEB_WORKER_CONNECTIONS") or 1000)
+threads = int(environ.get("WEB_THREADS") or 50)
+timeout = int(environ.get("WEB_TIMEOUT") or 60)
+graceful_timeout = int(environ.get("WEB_GRACEFUL_TIMEOUT") or 30)
+
+# each worker must open its own MQTT connection, DB pool and background threads
+preload_app = False
+
+
+def on_starting(server):
+    if workers > 1 and not (
+        environ.get("SOCKETIO_MESSAGE_QUEUE")
+        and (environ.get("CLUSTER_MODE") or "").lower() == "true"
+    ):
+        server.log.warning(
+            "WEB_WORKERS > 1 needs CLUSTER_MODE=true and SOCKETIO_MESSAGE_QUEUE, "
+            "otherwise values are ingested once per worker and emits only reach "
+            "clients connected to the emitting worker"
+        )
@@ -0,0 +1,14 @@
+import sys
+
+from app.migrations import (check_foreign_key_indexes, explain_index_usage,
+                            run_migrations)
+
+check_foreign_key_indexes()
+
+if "--check" in sys.argv:
+    failed = [name for name, indexed in explain_index_usage().items() if not indexed]
+    for name in failed:
+        print("No index scan for", name)
+    sys.exit(1 if failed else 0)
+
+run_migrations()
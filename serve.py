@@ -0,0 +1,30 @@
+from os import environ
+
+SERVER_MODE = environ.get("SERVER_MODE") or "eventlet"
+
+# cooperative modes must patch the stdlib and psycopg2 before anything opens sockets
+if SERVER_MODE == "eventlet":
+    import eventlet
+
+    eventlet.monkey_patch()
+    from psycogreen.eventlet import patch_psycopg
+
+    patch_psycopg()
+elif SERVER_MODE == "gevent":
+    from gevent import monkey
+
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+
+environ.setdefault("SOCKETIO_ASYNC_MODE", SERVER_MODE)
+
+from app import app, socketio
+
+if __name__ == "__main__":
+    socketio.run(
+        app,
+        host=environ.get("HOST") or "0.0.0.0",
+        port=int(environ.get("PORT") or 5000),
+    )
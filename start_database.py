@@ -1,6 +1,9 @@
 from app.database import DeviceType, db
+from app.migrations import check_foreign_key_indexes, run_migrations
 
+check_foreign_key_indexes()
 db.create_all()
+run_migrations()
 
 dev_types = [
     'glucometer',
@@ -0,0 +1,63 @@
+# The suite runs against a disposable Postgres database and an MQTT broker,
+# configured through the same SERVER_* and BROKER_* variables as the app.
+import os
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+os.environ.setdefault("SECRET_KEY", "tests-only-secret-key-of-sufficient-length")
+
+
+@pytest.fixture(scope="session")
+def app():
+    try:
+        from app import app
+    except OSError as e:
+        pytest.skip(f"MQTT broker not reachable: {e}")
+    from app.database import db
+
+    with app.app_context():
+        try:
+            db.session.execute(text("SELECT 1"))
+        except SQLAlchemyError as e:
+            pytest.skip(f"Database not reachable: {e}")
+        db.create_all()
+        from app.migrations import run_migrations
+
+        run_migrations()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        token = create_access_token("tests@example.com")
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def sql_statements(app):
+    from app.database import db
+
+    with app.app_context():
+        engines = [db.engine] + [
+            db.get_engine(app, bind=bind) for bind in app.config.get("SQLALCHEMY_BINDS") or {}
+        ]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", record)
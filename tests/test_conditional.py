@@ -0,0 +1,52 @@
+import secrets
+
+import pytest
+
+
+@pytest.fixture
+def device(app):
+    # importing app connects to the broker, so it waits for the skipping app fixture
+    from app.cache import table_versions
+    from app.database import Device, db
+
+    with app.app_context():
+        device = Device(serie_number=f"test-{secrets.token_hex(6)}", alias_name="test")
+        db.session.add(device)
+        db.session.commit()
+        id = device.id
+    table_versions.bump("device")
+    yield id
+    with app.app_context():
+        Device.query.filter(Device.id == id).delete()
+        db.session.commit()
+    table_versions.bump("device")
+
+
+@pytest.mark.parametrize("path", ["/device_type/", "/device/"])
+def test_not_modified_issues_no_sql(client, auth_headers, sql_statements, path):
+    response = client.get(path, headers=auth_headers)
+    assert response.status_code == 200
+    response.get_json()
+    etag = response.headers["ETag"]
+
+    sql_statements.clear()
+    response = client.get(path, headers=dict(auth_headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Cache-Control"]
+    assert sql_statements == []
+
+
+def test_device_etag_changes_after_a_write(client, auth_headers, device):
+    path = f"/device/{device}"
+    response = client.get(path, headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.patch(path, headers=auth_headers, json={"alias_name": "renamed"})
+    assert response.status_code == 200
+
+    response = client.get(path, headers=dict(auth_headers, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert response.get_json()["alias_name"] == "renamed"
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,96 @@
+import secrets
+
+import pytest
+
+
+@pytest.fixture
+def make_device_types(app):
+    # importing app connects to the broker, so it waits for the skipping app fixture
+    from app.cache import CATALOG_TABLES, table_versions
+    from app.database import (DeviceAction, DeviceActionParam, DeviceField,
+                              DeviceType, db)
+
+    created = []
+
+    def make(count):
+        with app.app_context():
+            for _ in range(count):
+                device_type = DeviceType(name=f"test-{secrets.token_hex(6)}")
+                db.session.add(device_type)
+                db.session.flush()
+                for index in range(2):
+                    action = DeviceAction(
+                        name=f"action {index}", function=f"fn{index}", device_type=device_type.id
+                    )
+                    db.session.add(action)
+                    db.session.flush()
+                    db.session.add_all(
+                        DeviceActionParam(name=f"param {i}", param_type="int", action=action.id)
+                        for i in range(2)
+                    )
+                    db.session.add(
+                        DeviceField(
+                            name=f"field {index}", field_type="float", device_type=device_type.id
+                        )
+                    )
+                created.append(device_type.id)
+            db.session.commit()
+        table_versions.bump(*CATALOG_TABLES)
+
+    yield make
+
+    with app.app_context():
+        actions = db.session.query(DeviceAction.id).filter(DeviceAction.device_type.in_(created))
+        DeviceActionParam.query.filter(DeviceActionParam.action.in_(actions)).delete(
+            synchronize_session=False
+        )
+        DeviceAction.query.filter(DeviceAction.device_type.in_(created)).delete(
+            synchronize_session=False
+        )
+        DeviceField.query.filter(DeviceField.device_type.in_(created)).delete(
+            synchronize_session=False
+        )
+        DeviceType.query.filter(DeviceType.id.in_(created)).delete(synchronize_session=False)
+        db.session.commit()
+    table_versions.bump(*CATALOG_TABLES)
+
+
+def test_catalog_query_count_does_not_grow_with_types(
+    client, auth_headers, sql_statements, make_device_types
+):
+    make_device_types(2)
+    sql_statements.clear()
+    response = client.get("/device_type/", headers=auth_headers)
+    assert response.status_code == 200
+    response.get_json()
+    few = len(sql_statements)
+
+    make_device_types(8)
+    sql_statements.clear()
+    response = client.get("/device_type/", headers=auth_headers)
+    assert response.status_code == 200
+    created = [item for item in response.get_json() if item["name"].startswith("test-")]
+    assert len(created) == 10
+    assert all(len(item["actions"]) == 2 and len(item["fields"]) == 2 for item in created)
+    assert len(sql_statements) == few
+    assert few <= 2
+
+
+def test_catalog_is_served_from_cache_until_a_write(
+    client, auth_headers, sql_statements, make_device_types
+):
+    make_device_types(1)
+    client.get("/device_type/", headers=auth_headers).get_json()
+
+    sql_statements.clear()
+    response = client.get("/device_type/", headers=auth_headers)
+    assert response.status_code == 200
+    response.get_json()
+    assert sql_statements == []
+
+    make_device_types(1)
+    sql_statements.clear()
+    response = client.get("/device_type/", headers=auth_headers)
+    assert response.status_code == 200
+    response.get_json()
+    assert sql_statements
@@ -0,0 +1,36 @@
+import pytest
+
+
+def test_every_foreign_key_has_an_index(app):
+    from app.migrations import missing_foreign_key_indexes
+
+    with app.app_context():
+        assert missing_foreign_key_indexes() == []
+
+
+def test_hot_queries_can_use_an_index(app):
+    from app.migrations import EXPLAIN_QUERIES, explain_index_usage
+
+    with app.app_context():
+        usage = explain_index_usage()
+    assert usage.keys() == EXPLAIN_QUERIES.keys()
+    assert [name for name, indexed in usage.items() if not indexed] == []
+
+
+@pytest.mark.parametrize(
+    "name", ["ix_device_device_type", "ix_telemetry_serie_number_field_timestamp"]
+)
+def test_migrated_indexes_are_valid(app, name):
+    from sqlalchemy import text
+
+    from app.database import db
+
+    with app.app_context():
+        valid = db.session.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name"
+            ),
+            {"name": name},
+        ).scalar()
+    assert valid is True
@@ -0,0 +1,71 @@
+import secrets
+
+import pytest
+
+
+@pytest.fixture
+def device_type(app):
+    from app.cache import CATALOG_TABLES, table_versions
+    from app.database import DeviceField, DeviceType, db
+
+    with app.app_context():
+        device_type = DeviceType(name=f"test-{secrets.token_hex(6)}")
+        db.session.add(device_type)
+        db.session.commit()
+        id = device_type.id
+    yield id
+    with app.app_context():
+        DeviceField.query.filter(DeviceField.device_type == id).delete()
+        DeviceType.query.filter(DeviceType.id == id).delete()
+        db.session.commit()
+    table_versions.bump(*CATALOG_TABLES)
+
+
+def test_converted_fields_publish_the_canonical_unit(client, auth_headers, device_type):
+    from app.schema import telemetry_schemas
+
+    response = client.post(
+        "/device_type/field/",
+        headers=auth_headers,
+        json={
+            "name": "temperature",
+            "unit": "F",
+            "field_type": "float",
+            "device_type": device_type,
+        },
+    )
+    assert response.status_code == 200
+    field = response.get_json()
+    assert (field["unit"], field["reported_unit"]) == ("C", "F")
+
+    catalog = client.get(f"/device_type/{device_type}", headers=auth_headers).get_json()
+    assert [(item["unit"], item["reported_unit"]) for item in catalog["fields"]] == [("C", "F")]
+    assert telemetry_schemas.apply(device_type, {"temperature": 98.6}) == {
+        "temperature": pytest.approx(37.0)
+    }
+
+    # clients echoing the published unit back must not lose the conversion
+    response = client.patch(
+        f"/device_type/field/{field['id']}", headers=auth_headers, json={"unit": "C"}
+    )
+    assert (response.get_json()["unit"], response.get_json()["reported_unit"]) == ("C", "F")
+
+    response = client.patch(
+        f"/device_type/field/{field['id']}", headers=auth_headers, json={"unit": "K"}
+    )
+    assert (response.get_json()["unit"], response.get_json()["reported_unit"]) == ("C", "K")
+    assert telemetry_schemas.apply(device_type, {"temperature": 310.15}) == {
+        "temperature": pytest.approx(37.0)
+    }
+
+
+def test_integer_fields_reject_fractional_values(app):
+    from app.schema import TelemetrySchema
+
+    schema = TelemetrySchema(
+        [{"name": "heart_rate", "field_type": "int", "unit": "bpm", "reported_unit": None}]
+    )
+    for value, expected in ((72, 72), (72.0, 72), ("72", 72), ("72.0", 72)):
+        assert schema.apply({"heart_rate": value}) == ({"heart_rate": expected}, 0)
+    for value in (72.5, "72.5", True, float("nan"), "fast"):
+        assert schema.apply({"heart_rate": value}) == ({}, 1)